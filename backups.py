@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import db_new
+from logs import Log
+
+load_dotenv()
+BACKUP_DIR = Path(os.getenv("DB_BACKUP_DIR", "backups"))
+# Minutes between scheduled backups
+BACKUP_INTERVAL = float(os.getenv("DB_BACKUP_INTERVAL", "360"))
+# Number of snapshots kept, the oldest ones are deleted first
+BACKUP_KEEP = int(os.getenv("DB_BACKUP_KEEP", "14"))
+# Pages copied per backup step, and seconds slept between steps
+BACKUP_PAGE_STEP = int(os.getenv("DB_BACKUP_PAGE_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("DB_BACKUP_STEP_SLEEP", "0.01"))
+
+SUFFIX = ".db.gz"
+
+
+def database_path(database: db_new.Database) -> Path:
+    """Returns the path of a database's file, raising ValueError for in-memory databases."""
+    path = database.write_engine.url.database
+    if not path or path == ":memory:":
+        raise ValueError(f"The {database.name} database has no file to back up")
+    return Path(path)
+
+
+def _snapshot_name(name: str, database: db_new.Database) -> str:
+    # shards are saved next to the main snapshot, as e.g. database-<time>.shard0.db.gz
+    if database is db_new.database:
+        return f"{name}{SUFFIX}"
+    return f"{name}.{database.name}{SUFFIX}"
+
+
+def _copy_snapshot(source: Path, target: Path, pages: int, sleep: float) -> int:
+    with contextlib.closing(sqlite3.connect(source)) as src, contextlib.closing(
+        sqlite3.connect(target)
+    ) as dst:
+        # An open read transaction pins the source to one WAL snapshot, so
+        # concurrent writes neither block nor restart the copy.
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=pages, sleep=sleep)
+        src.rollback()
+        return dst.execute("PRAGMA page_count").fetchone()[0]
+
+
+def _compress(source: Path, target: Path) -> None:
+    with open(source, "rb") as raw, gzip.open(target, "wb") as compressed:
+        shutil.copyfileobj(raw, compressed, 1024 * 1024)
+
+
+def _decompress(source: Path, target: Path) -> None:
+    with gzip.open(source, "rb") as compressed, open(target, "wb") as raw:
+        shutil.copyfileobj(compressed, raw, 1024 * 1024)
+
+
+def list_backups() -> list[Path]:
+    """Returns the main file of every snapshot in :data:`BACKUP_DIR`, newest first."""
+    if not BACKUP_DIR.is_dir():
+        return []
+    return sorted(
+        (path for path in BACKUP_DIR.glob(f"*{SUFFIX}") if ".shard" not in path.name),
+        reverse=True,
+    )
+
+
+def _shard_snapshots(snapshot: Path) -> list[Path]:
+    return list(BACKUP_DIR.glob(f"{snapshot.name[: -len(SUFFIX)]}.shard*{SUFFIX}"))
+
+
+def rotate(keep: int = BACKUP_KEEP) -> list[Path]:
+    """Deletes all but the ``keep`` newest snapshots, returning the deleted ones."""
+    removed = list_backups()[keep:]
+    for path in removed:
+        for shard in _shard_snapshots(path):
+            shard.unlink()
+        path.unlink()
+    return removed
+
+
+async def create_backup(
+    pages: int = BACKUP_PAGE_STEP, sleep: float = BACKUP_STEP_SLEEP
+) -> Path:
+    """|coro|
+    Takes a consistent snapshot of the live database and its shards, compresses it and rotates old ones.
+
+    The copy runs in a worker thread, ``pages`` pages at a time, so neither the
+    event loop nor the writer connection wait on it.
+
+    Returns:
+        Path: The new compressed snapshot of the main database.
+    """
+    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+    name = datetime.now(timezone.utc).strftime("database-%Y%m%d-%H%M%S")
+    start = time.perf_counter()
+    page_count = 0
+    with tempfile.TemporaryDirectory(dir=BACKUP_DIR) as tmp:
+        for database in db_new.all_databases():
+            snapshot = Path(tmp) / f"{database.name}.db"
+            page_count += await asyncio.to_thread(
+                _copy_snapshot, database_path(database), snapshot, pages, sleep
+            )
+            await asyncio.to_thread(
+                _compress, snapshot, BACKUP_DIR / _snapshot_name(name, database)
+            )
+    target = BACKUP_DIR / _snapshot_name(name, db_new.database)
+    removed = rotate()
+    Log["database"].info(
+        f"Backed up {page_count} pages to {target} in {time.perf_counter() - start:.2f}s"
+        + (f", removed {len(removed)} old snapshots" if removed else "")
+    )
+    return target
+
+
+def _restore_snapshot(snapshot: Path, target: Path) -> None:
+    with contextlib.closing(sqlite3.connect(snapshot)) as src, contextlib.closing(
+        sqlite3.connect(target, timeout=db_new.SQLITE_PRAGMAS["busy_timeout"] / 1000)
+    ) as dst:
+        # in one step, readers see either the old or the restored database
+        src.backup(dst)
+
+
+async def restore_backup(name: str) -> Path:
+    """|coro|
+    Replaces the live database's and its shards' contents with a snapshot, then migrates them if they're older.
+
+    Every writer is paused for the whole restore, migrations included. A write
+    batch that's already running finishes first, writes queued meanwhile are
+    committed to the restored database afterwards. Callers should drop anything
+    they cached from the database.
+
+    Args:
+        name: File name of a snapshot in :data:`BACKUP_DIR`.
+
+    Returns:
+        Path: The restored snapshot.
+    """
+    snapshot = BACKUP_DIR / Path(name).name
+    if not snapshot.is_file():
+        raise FileNotFoundError(f"No backup named {name}")
+    stem = snapshot.name[: -len(SUFFIX)]
+    async with contextlib.AsyncExitStack() as paused:
+        for database in db_new.all_databases():
+            await paused.enter_async_context(database.writer.paused())
+        with tempfile.TemporaryDirectory(dir=BACKUP_DIR) as tmp:
+            for database in db_new.all_databases():
+                source = BACKUP_DIR / _snapshot_name(stem, database)
+                if not source.is_file():
+                    # taken before sharding was turned on, or with fewer shards
+                    Log["database"].warning(
+                        f"{name} has no snapshot of {database.name}"
+                    )
+                    continue
+                restored = Path(tmp) / f"{database.name}.db"
+                await asyncio.to_thread(_decompress, source, restored)
+                # sessions writing around the queue wait for the copy too
+                async with database.write_engine.connect():
+                    await asyncio.to_thread(
+                        _restore_snapshot, restored, database_path(database)
+                    )
+        # needs the writer connections, but runs before any queued write
+        await db_new.init_db()
+    Log["database"].warning(f"Restored database from {snapshot}")
+    return snapshot
@@ -0,0 +1,101 @@
+"""Sessions per second, before and after the shared session factory + pragmas.
+
+Run from the repository root:
+
+    python -m benchmarks.sessions [sessions] [concurrency] [write_ratio]
+
+Each session reads one ``UserConfig`` row, and every ``1 / write_ratio``-th
+session also writes one. Both setups run against a fresh database file in a
+temporary directory, so ``database.db`` is never touched.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import db_new
+
+
+def _legacy_factory(engine):
+    # What get_session() used to do: a new sessionmaker on every call.
+    def open_session():
+        return sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)()
+
+    return open_session
+
+
+def _shared_factory(engine):
+    factory = db_new.async_sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False
+    )
+    return factory
+
+
+async def _run(engine, open_session, sessions, concurrency, write_ratio):
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    user_ids = list(range(1, 1001))
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            async with open_session() as session:
+                user_id = random.choice(user_ids)
+                try:
+                    if write_ratio and i % write_ratio == 0:
+                        await db_new.update_user_config(session, user_id, Starbits=i)
+                    else:
+                        await db_new.get_user_config(session, user_id)
+                except OperationalError:  # "database is locked"
+                    errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    return sessions / elapsed, errors
+
+
+async def main(sessions: int, concurrency: int, write_ratio: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        before = create_async_engine(
+            f"sqlite+aiosqlite:///{os.path.join(tmp, 'before.db')}", future=True
+        )
+        before_rate, before_errors = await _run(
+            before, _legacy_factory(before), sessions, concurrency, write_ratio
+        )
+
+        after = db_new.create_engine(
+            f"sqlite+aiosqlite:///{os.path.join(tmp, 'after.db')}"
+        )
+        after_rate, after_errors = await _run(
+            after, _shared_factory(after), sessions, concurrency, write_ratio
+        )
+
+    print(f"sessions={sessions} concurrency={concurrency} write_ratio=1/{write_ratio}")
+    print(
+        f"before: {before_rate:10.1f} sessions/s, {before_errors} locked "
+        "(default pragmas, new factory)"
+    )
+    print(
+        f"after:  {after_rate:10.1f} sessions/s, {after_errors} locked "
+        "(tuned pragmas, shared factory)"
+    )
+    print(f"speedup: {after_rate / before_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    sessions, concurrency, write_ratio = (args + [5000, 32, 10][len(args) :])[:3]
+    asyncio.run(main(sessions, concurrency, write_ratio))
@@ -0,0 +1,106 @@
+"""Messages matched per second, one check per rule vs the compiled trigger set.
+
+Run from the repository root:
+
+    python -m benchmarks.triggers [rules] [messages] [exact_ratio]
+
+Every ``1 / exact_ratio``-th rule is an exact one, the rest match anywhere in
+the message. Messages are a handful of random words, some of them hitting a
+rule. The target is 10k messages per second on a single core.
+"""
+
+import random
+import sys
+import time
+
+import triggers
+
+TARGET = 10_000
+
+WORDS = (
+    "the a to and of is it you that in this for on was with fr ok lol bro "
+    "what why how when game play voice channel server role bot music song "
+    "good boy nice cool based cringe real true fake hello bye gg wp ez"
+).split()
+
+
+def _random_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _rules(count: int, exact_ratio: int, rng: random.Random) -> list[triggers.Trigger]:
+    rules = list(triggers.DEFAULT_TRIGGERS)
+    for i in range(count - len(rules)):
+        if exact_ratio and i % exact_ratio == 0:
+            rules.append(
+                triggers.Trigger(_random_text(rng, rng.randint(1, 3)), "exact", "👍")
+            )
+        else:
+            # made up words, so most of them don't match everything
+            pattern = "".join(
+                rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(5)
+            )
+            rules.append(triggers.Trigger(pattern, "contains", "👍"))
+    return rules
+
+
+def _naive(rules: list[triggers.Trigger]):
+    # What on_message used to do: lower the content and test every rule on its own.
+    def match(content: str) -> list[triggers.Trigger]:
+        lowered = content.lower()
+        return [
+            rule
+            for rule in rules
+            if (
+                rule.pattern in lowered
+                if rule.match == "contains"
+                else rule.pattern == lowered
+            )
+        ]
+
+    return match
+
+
+def _compiled(rules: list[triggers.Trigger]):
+    trigger_set = triggers.TriggerSet(rules)
+
+    def match(content: str) -> list[triggers.Trigger]:
+        return trigger_set.match(triggers.normalize(content))
+
+    return match
+
+
+def _rate(match, messages: list[str]) -> tuple[float, int]:
+    start = time.perf_counter()
+    hits = sum(len(match(message)) for message in messages)
+    return len(messages) / (time.perf_counter() - start), hits
+
+
+def main(rules: int, messages: int, exact_ratio: int):
+    rng = random.Random(0)
+    rule_list = _rules(rules, exact_ratio, rng)
+    contents = [_random_text(rng, rng.randint(1, 20)) for _ in range(messages)]
+
+    start = time.perf_counter()
+    compiled = _compiled(rule_list)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    before_rate, before_hits = _rate(_naive(rule_list), contents)
+    after_rate, after_hits = _rate(compiled, contents)
+
+    print(f"rules={len(rule_list)} messages={messages} exact_ratio=1/{exact_ratio}")
+    print(
+        f"before: {before_rate:10.0f} msgs/s, {before_hits} matches (one check per rule)"
+    )
+    print(
+        f"after:  {after_rate:10.0f} msgs/s, {after_hits} matches "
+        f"(compiled in {compile_ms:.1f} ms)"
+    )
+    print(f"speedup: {after_rate / before_rate:.2f}x")
+    print(f"target {TARGET} msgs/s: {'met' if after_rate >= TARGET else 'missed'}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    rules, messages, exact_ratio = (args + [500, 100_000, 4][len(args) :])[:3]
+    main(rules, messages, exact_ratio)
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Iterable
+
+from dotenv import load_dotenv
+
+load_dotenv()
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))  # seconds
+SERVER_CACHE_SIZE = int(os.getenv("CACHE_SERVER_SIZE", "10000"))
+USER_CACHE_SIZE = int(os.getenv("CACHE_USER_SIZE", "50000"))
+
+MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire ``ttl`` seconds after being stored.
+
+    Attributes:
+        name: Name shown in stats.
+        maxsize: Maximum number of entries, the least recently used one is evicted first.
+        ttl: Seconds an entry stays valid.
+        hits: Number of lookups answered from the cache.
+        misses: Number of lookups that weren't.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float = CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # bumped on every invalidation, so a load that raced with a write isn't stored
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value for ``key``, or ``default`` if it's missing or expired."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def get_or_load(
+        self, key: Hashable, loader: Callable[[Hashable], Awaitable[Any]]
+    ) -> Any:
+        """|coro|
+        Returns the cached value for ``key``, calling ``await loader(key)`` and caching the result on a miss.
+        """
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        generation = self._generation
+        value = await loader(key)
+        if generation == self._generation:
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        self._generation += 1
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class BatchLoader:
+    """Collects the keys requested during one event loop iteration and loads them with one call.
+
+    ``batch_fn`` gets a list of distinct keys and must return a dict with a value
+    for every one of them. Concurrent requests for the same key share one result.
+
+    Attributes:
+        batches: Number of times ``batch_fn`` was called.
+        loads: Number of keys passed to ``batch_fn`` in total.
+    """
+
+    def __init__(
+        self, batch_fn: Callable[[list[Hashable]], Awaitable[dict[Hashable, Any]]]
+    ):
+        self.batch_fn = batch_fn
+        self.batches = 0
+        self.loads = 0
+        self._pending: dict[Hashable, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def load(self, key: Hashable) -> Any:
+        """|coro|
+        Returns the value for ``key`` once the current batch has been loaded.
+        """
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._pending:
+                # runs after every callback that's already queued, i.e. at the end of this tick
+                loop.call_soon(self._dispatch)
+            future = self._pending[key] = loop.create_future()
+        # one caller being cancelled mustn't cancel the others waiting on the same key
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[Hashable]) -> list[Any]:
+        """|coro|
+        Returns the values for ``keys``, loaded in the same batch.
+        """
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def _dispatch(self) -> None:
+        pending, self._pending = self._pending, {}
+        task = asyncio.create_task(self._resolve(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, pending: dict[Hashable, asyncio.Future]) -> None:
+        self.batches += 1
+        self.loads += len(pending)
+        try:
+            values = await self.batch_fn(list(pending))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(values[key])
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "loads": self.loads,
+            "keys_per_batch": self.loads / self.batches if self.batches else 0.0,
+        }
+
+
+server_configs = TTLCache("server_configs", SERVER_CACHE_SIZE)
+user_configs = TTLCache("user_configs", USER_CACHE_SIZE)
+caches = [server_configs, user_configs]
+
+
+def clear_all() -> None:
+    """Drops every cached entry, for when the database was changed behind our back."""
+    for c in caches:
+        c.clear()
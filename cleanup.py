@@ -0,0 +1,189 @@
+import os
+from dataclasses import dataclass, field
+
+import discord
+from dotenv import load_dotenv
+
+import db_new
+
+load_dotenv()
+# Minutes between comparisons of the stored IDs with the gateway cache
+RECONCILE_INTERVAL = float(os.getenv("DB_RECONCILE_INTERVAL", "720"))
+
+
+@dataclass(slots=True)
+class GuildReferences:
+    """The role and channel IDs a guild's stored rows refer to."""
+
+    roles: set[int] = field(default_factory=set)
+    channels: set[int] = field(default_factory=set)
+
+
+@dataclass(slots=True)
+class Orphans:
+    """Stored IDs that no longer exist on Discord.
+
+    Attributes:
+        guilds: Guilds the bot isn't in anymore.
+        roles: Deleted roles, by guild.
+        channels: Deleted channels, by guild.
+    """
+
+    guilds: set[int] = field(default_factory=set)
+    roles: dict[int, set[int]] = field(default_factory=dict)
+    channels: dict[int, set[int]] = field(default_factory=dict)
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.guilds)} guilds, "
+            f"{sum(map(len, self.roles.values()))} roles and "
+            f"{sum(map(len, self.channels.values()))} channels"
+        )
+
+
+def forget(bot: discord.Client, method: str, *args) -> None:
+    """Calls ``method`` on every cog implementing it, so they drop their in-memory copy of purged rows.
+
+    The hooks are ``forget_guild(guild_id)``, ``forget_roles(guild_id, role_ids)``,
+    ``forget_channels(guild_id, channel_ids)`` and ``forget_messages(guild_id, message_ids)``.
+    """
+    for cog in bot.cogs.values():
+        if hasattr(cog, method):
+            getattr(cog, method)(*args)
+
+
+async def purge_guild(bot: discord.Client, guild_id: int) -> int:
+    """|coro|
+    Deletes everything stored about a guild, in the database and in every cog.
+    """
+    deleted = await db_new.write_guild(guild_id, db_new.purge_guild, guild_id)
+    forget(bot, "forget_guild", guild_id)
+    return deleted
+
+
+async def purge_roles(bot: discord.Client, guild_id: int, role_ids: set[int]) -> int:
+    """|coro|
+    Deletes the auto roles and reaction roles of deleted roles, in the database and in every cog.
+    """
+    deleted = await db_new.write_guild(guild_id, db_new.purge_roles, guild_id, role_ids)
+    forget(bot, "forget_roles", guild_id, role_ids)
+    return deleted
+
+
+async def purge_channels(
+    bot: discord.Client, guild_id: int, channel_ids: set[int]
+) -> int:
+    """|coro|
+    Deletes the rows referring to deleted channels, in the database and in every cog.
+    """
+    deleted = await db_new.write_guild(
+        guild_id, db_new.purge_channels, guild_id, channel_ids
+    )
+    forget(bot, "forget_channels", guild_id, channel_ids)
+    return deleted
+
+
+async def purge_messages(
+    bot: discord.Client, guild_id: int, message_ids: set[int]
+) -> int:
+    """|coro|
+    Deletes the reaction roles of deleted messages, in the database and in every cog.
+    """
+    # most deleted messages have nothing stored, so look before queuing a write
+    reaction_roles = bot.get_cog("ReactionRoles")
+    if reaction_roles is not None:
+        # its index holds every reaction role, a miss needs no round-trip
+        message_ids = {m for m in message_ids if m in reaction_roles.index.roles}
+    else:
+        async with db_new.get_session(guild_id) as session:
+            message_ids = await db_new.get_referenced_messages(session, message_ids)
+    if not message_ids:
+        return 0
+    deleted = await db_new.write_guild(
+        guild_id, db_new.delete_reaction_roles_by_messages, message_ids
+    )
+    forget(bot, "forget_messages", guild_id, message_ids)
+    return deleted
+
+
+async def load_references() -> dict[int, GuildReferences]:
+    """|coro|
+    Streams every guild-scoped table once and collects the IDs their rows refer to, by guild.
+    """
+    references: dict[int, GuildReferences] = {}
+
+    def of(guild_id: int) -> GuildReferences:
+        if guild_id not in references:
+            references[guild_id] = GuildReferences()
+        return references[guild_id]
+
+    ServerConfig = db_new.ServerConfig
+    ReactionRole = db_new.ReactionRole
+    for database in db_new.guild_databases():
+        async with database.session() as session:
+            async for guild_id, *channel_ids in db_new.stream_columns(
+                session,
+                ServerConfig.ServerID,
+                ServerConfig.WelcomeChannelID,
+                ServerConfig.VoiceCreationChannelID,
+            ):
+                of(guild_id).channels.update(c for c in channel_ids if c is not None)
+            async for guild_id, role_id in db_new.stream_columns(
+                session, db_new.AutoRole.GuildID, db_new.AutoRole.RoleID
+            ):
+                of(guild_id).roles.add(role_id)
+            async for guild_id, channel_id, role_id in db_new.stream_columns(
+                session,
+                ReactionRole.GuildID,
+                ReactionRole.ChannelID,
+                ReactionRole.RoleID,
+            ):
+                # the channel of legacy reaction roles is unknown (NULL), or still
+                # the guild ID in rows imported from dumps of unmigrated databases
+                if channel_id is not None and channel_id != guild_id:
+                    of(guild_id).channels.add(channel_id)
+                of(guild_id).roles.add(role_id)
+            async for guild_id, channel_id in db_new.stream_columns(
+                session, db_new.TempChannel.GuildID, db_new.TempChannel.ChannelID
+            ):
+                of(guild_id).channels.add(channel_id)
+    return references
+
+
+async def find_orphans(
+    bot: discord.Client, references: dict[int, GuildReferences]
+) -> Orphans:
+    """|coro|
+    Diffs stored IDs against the gateway cache.
+
+    Guilds and roles are cached completely, so anything missing is gone.
+    Archived threads aren't cached though, so channels missing from the cache
+    are looked up once more through the API before they count as deleted.
+    """
+    orphans = Orphans()
+    # an empty cache means something's off with the gateway, not that we were kicked everywhere
+    check_guilds = bool(bot.guilds)
+    for guild_id, refs in references.items():
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            if check_guilds:
+                orphans.guilds.add(guild_id)
+            continue
+        if guild.unavailable:
+            continue
+        roles = {role_id for role_id in refs.roles if guild.get_role(role_id) is None}
+        if roles:
+            orphans.roles[guild_id] = roles
+        channels = set()
+        for channel_id in refs.channels - {guild_id}:
+            if guild.get_channel_or_thread(channel_id) is not None:
+                continue
+            try:
+                await guild.fetch_channel(channel_id)
+            except discord.NotFound:
+                channels.add(channel_id)
+            except discord.HTTPException:
+                pass  # missing access or a hiccup, try again next time
+        if channels:
+            orphans.channels[guild_id] = channels
+    return orphans
@@ -0,0 +1,80 @@
+import asyncio
+
+from discord.ext import commands, tasks
+
+import backups
+import cache
+import conf
+import func
+from logs import Log
+
+
+class Backups(commands.Cog):
+    def __init__(self, bot):
+        self.bot: commands.Bot = bot
+        self.description = "Database Backups"
+        self.emoji = "💾"
+        self.hidden = True
+
+    async def cog_load(self):
+        self.scheduled_backup.start()
+
+    async def cog_unload(self):
+        self.scheduled_backup.cancel()
+
+    @tasks.loop(minutes=backups.BACKUP_INTERVAL)
+    async def scheduled_backup(self):
+        try:
+            await backups.create_backup()
+        except Exception as e:
+            Log["database"].error(f"Scheduled backup failed: {e}")
+
+    @scheduled_backup.before_loop
+    async def before_scheduled_backup(self):
+        # the first backup is taken one interval after startup, not during it
+        await self.bot.wait_until_ready()
+        await asyncio.sleep(backups.BACKUP_INTERVAL * 60)
+
+    @commands.hybrid_command("backup")
+    @func.is_developer()
+    async def backup(self, ctx):
+        """Back up the database now (Developer only)"""
+        await ctx.defer(ephemeral=True)
+        path = await backups.create_backup()
+        await ctx.send(f"Backed up the database to `{path.name}`", ephemeral=True)
+
+    @commands.hybrid_command("backups")
+    @func.is_developer()
+    async def list_backups(self, ctx):
+        """List the database backups (Developer only)"""
+        paths = backups.list_backups()
+        listing = "\n".join(
+            f"{path.name} ({path.stat().st_size / 1024:.0f} KiB)" for path in paths
+        )
+        await ctx.send(
+            embed=func.Embed()
+            .title("Database Backups")
+            .description(f"```\n{listing or 'No backups yet'}```")
+            .embed,
+            ephemeral=True,
+        )
+
+    @commands.hybrid_command("restore")
+    @func.is_developer()
+    async def restore(self, ctx, name: str):
+        """Restore the database from a backup (Developer only)"""
+        await ctx.defer(ephemeral=True)
+        try:
+            await backups.restore_backup(name)
+        except FileNotFoundError as e:
+            await ctx.send(str(e), ephemeral=True)
+            return
+        # everything loaded from the old database is stale now
+        cache.clear_all()
+        await conf.load_starbits_ranking()
+        await conf.load_cog_snapshots(self.bot)
+        await ctx.send(f"Restored the database from `{name}`", ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(Backups(bot))
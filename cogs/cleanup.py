@@ -0,0 +1,109 @@
+import discord
+from discord.ext import commands, tasks
+
+import cleanup
+import db_new
+import func
+from logs import Log
+
+
+class Cleanup(commands.Cog):
+    """Deletes stored rows that refer to guilds, roles, channels or messages that are gone.
+
+    Cogs keeping their own copy of that data can implement the hooks
+    :func:`cleanup.forget` calls to drop it as well.
+    """
+
+    def __init__(self, bot):
+        self.bot: commands.Bot = bot
+        self.description = "Database Cleanup"
+        self.emoji = "🧽"
+        self.hidden = True
+
+    async def cog_load(self):
+        self.scheduled_reconcile.start()
+
+    async def cog_unload(self):
+        self.scheduled_reconcile.cancel()
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        deleted = await cleanup.purge_guild(self.bot, guild.id)
+        Log["database"].info(f"Left {guild.name}, deleted {deleted} rows")
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        # most roles are neither auto roles nor reaction roles, a read is cheaper than a write
+        async with db_new.get_session(role.guild.id) as session:
+            role_ids = await db_new.get_referenced_roles(session, {role.id})
+        if role_ids:
+            await cleanup.purge_roles(self.bot, role.guild.id, role_ids)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        await self._channels_deleted(channel.guild.id, {channel.id})
+
+    @commands.Cog.listener()
+    async def on_raw_thread_delete(self, payload: discord.RawThreadDeleteEvent):
+        await self._channels_deleted(payload.guild_id, {payload.thread_id})
+
+    async def _channels_deleted(self, guild_id: int, channel_ids: set[int]):
+        # temp channels deleted by the voice cog already removed their row
+        async with db_new.get_session(guild_id) as session:
+            channel_ids = await db_new.get_referenced_channels(
+                session, guild_id, channel_ids
+            )
+        if channel_ids:
+            await cleanup.purge_channels(self.bot, guild_id, channel_ids)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.guild_id is not None:
+            await cleanup.purge_messages(
+                self.bot, payload.guild_id, {payload.message_id}
+            )
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(
+        self, payload: discord.RawBulkMessageDeleteEvent
+    ):
+        if payload.guild_id is not None:
+            await cleanup.purge_messages(
+                self.bot, payload.guild_id, payload.message_ids
+            )
+
+    async def reconcile(self) -> cleanup.Orphans:
+        """Deletes the rows of every guild, role and channel that's gone without us noticing, e.g. while offline."""
+        orphans = await cleanup.find_orphans(self.bot, await cleanup.load_references())
+        for guild_id in orphans.guilds:
+            await cleanup.purge_guild(self.bot, guild_id)
+        for guild_id, role_ids in orphans.roles.items():
+            await cleanup.purge_roles(self.bot, guild_id, role_ids)
+        for guild_id, channel_ids in orphans.channels.items():
+            await cleanup.purge_channels(self.bot, guild_id, channel_ids)
+        Log["database"].info(f"Reconciled the database, {orphans.summary()} were gone")
+        return orphans
+
+    @tasks.loop(minutes=cleanup.RECONCILE_INTERVAL)
+    async def scheduled_reconcile(self):
+        try:
+            await self.reconcile()
+        except Exception as e:
+            Log["database"].error(f"Reconciling the database failed: {e}")
+
+    @scheduled_reconcile.before_loop
+    async def before_scheduled_reconcile(self):
+        # the guild cache is only complete once the bot is ready
+        await self.bot.wait_until_ready()
+
+    @commands.hybrid_command("reconcile")
+    @func.is_developer()
+    async def reconcile_command(self, ctx):
+        """Delete stored data of deleted guilds, roles and channels (Developer only)"""
+        await ctx.defer(ephemeral=True)
+        orphans = await self.reconcile()
+        await ctx.send(f"Removed data of {orphans.summary()}", ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(Cleanup(bot))
@@ -31,30 +31,29 @@ class Economy(commands.Cog):
     @starbits.command("claim")
     async def starcollect(self, ctx):
         """Claim your daily starbits"""
-        ts = (await conf.get_user_config(ctx.author.id))["StarbitsNextCollect"]
-        if int(ts) > datetime.datetime.now().timestamp():
-            await ctx.send(
-                f"You have already claimed your daily starbits! You can claim again <t:{round(ts)}:R>"
-            )
-            Log["fun"].warning(
-                f"User {ctx.author.name} tried to collect starbits before time"
-            )
-            return
         amount = random.randint(1, 10)
         boosted = False
         if random.randint(0, 100) in random.choices(range(100), k=10):
             amount *= 2
             boosted = True
 
-        await conf.add_starbits(ctx.author.id, amount)
-        await conf.set_starbit_collection(
-            ctx.author.id,
-            round((datetime.datetime.now() + datetime.timedelta(days=1)).timestamp()),
-        )
-
         next = datetime.datetime.now()
         next += datetime.timedelta(days=1)
 
+        # checks the cooldown, adds the starbits and moves the cooldown in one statement
+        balance = await conf.claim_starbits(
+            ctx.author.id, amount, round(next.timestamp())
+        )
+        if balance is None:
+            ts = (await conf.get_user_config(ctx.author.id)).starbits_next_collect
+            await ctx.send(
+                f"You have already claimed your daily starbits! You can claim again <t:{round(ts)}:R>"
+            )
+            Log["fun"].warning(
+                f"User {ctx.author.name} tried to collect starbits before time"
+            )
+            return
+
         if boosted:
             await ctx.send(
                 f"✨ Claimed boosted {amount} {discord.PartialEmoji(name="starbit",id=1349479957868318810)} starbits ✨\nYou can claim again <t:{round(next.timestamp())}:R>"
@@ -69,30 +68,36 @@ class Economy(commands.Cog):
 
     @starbits.command("gamble")
     async def stargamble(self, ctx, amount: int):
-        bal = (await conf.get_user_config(ctx.author.id))["Starbits"]
-        if amount > bal:
-            await ctx.send(f"Insufficient funds. you have {bal} starbits.")
-            return
         if amount < 0:
             await ctx.send(f"Can't gamble negative funds!")
             return
-        await conf.add_starbits(ctx.author.id, -amount)  # withdraw funds
         r = random.randint(1, 100)
         if r < 5:
-            await ctx.send(f"JACKPOT! 10x ({amount*10})")
-            await conf.add_starbits(ctx.author.id, amount * 10)
+            payout = amount * 10
+            message = f"JACKPOT! 10x ({amount*10})"
         elif r < 20:
-            await ctx.send(f"Big Win! 3x ({amount*3})")
-            await conf.add_starbits(ctx.author.id, amount * 3)
+            payout = amount * 3
+            message = f"Big Win! 3x ({amount*3})"
         elif r < 40:
-            await ctx.send(f"Small Win. 1.5x ({round(amount*1.5)})")
-            await conf.add_starbits(ctx.author.id, round(amount * 1.5))
+            payout = round(amount * 1.5)
+            message = f"Small Win. 1.5x ({round(amount*1.5)})"
         elif r < 70:
-            await ctx.send(f"Loss! -100% ({amount*-1})")
-            await conf.add_starbits(ctx.author.id, 0)
+            payout = 0
+            message = f"Loss! -100% ({amount*-1})"
         elif r < 100:
-            await ctx.send(f"Critical Loss! -125% ({round(amount*-1.25)})")
-            await conf.add_starbits(ctx.author.id, round(amount * -0.25))
+            payout = round(amount * -0.25)
+            message = f"Critical Loss! -125% ({round(amount*-1.25)})"
+        else:
+            # a roll of 100 just loses the stake, without a message
+            payout = 0
+            message = None
+        # withdraws the stake and pays out in one statement, only if the balance covers it
+        if await conf.gamble_starbits(ctx.author.id, amount, payout) is None:
+            bal = (await conf.get_user_config(ctx.author.id)).starbits
+            await ctx.send(f"Insufficient funds. you have {bal} starbits.")
+            return
+        if message is not None:
+            await ctx.send(message)
 
     @starbits.command("balance")
     async def starbalance(self, ctx, user: discord.Member = None):
@@ -102,11 +107,25 @@ class Economy(commands.Cog):
             t = "You have"
         else:
             t = f"{user.mention} has"
-        amount = (await conf.get_user_config(user.id))["Starbits"]
+        amount = (await conf.get_user_config(user.id)).starbits
         await ctx.send(
             f"{t} {amount} {discord.PartialEmoji(name="starbit",id=1349479957868318810)} starbits"
         )
 
+    @starbits.command("rank")
+    async def starrank(self, ctx, user: discord.Member = None):
+        """Check your position on the global starbits leaderboard"""
+        if user is None:
+            user = ctx.author
+            t = "You are"
+        else:
+            t = f"{user.mention} is"
+        rank, total = await conf.get_starbits_rank(user.id)
+        if rank is None:
+            await ctx.send(f"{t} not ranked yet on the starbits leaderboard")
+            return
+        await ctx.send(f"{t} #{rank} of {total} on the starbits leaderboard")
+
     async def _get_or_fetch(self, ctx, id):
         m = ctx.bot.get_user(id)
         if m is None:
@@ -120,24 +139,19 @@ class Economy(commands.Cog):
         """Check the top 10 starbit holders ['global' or 'server']"""
         if reach == "global":
             title = "Global"
-            async with db_new.get_session() as session:
-                members = await db_new.get_all_user_ids(session)
-
-            members = [
-                await self._get_or_fetch(ctx, member_id) for member_id in members
-            ]
+            user_ids = None
         else:
             title = "Server"
-            members = ctx.guild.members
-        nm = {}
-        for i in members:
-            nm[i.name] = (await conf.get_user_config(i.id))["Starbits"]
-        nm = dict(sorted(nm.items(), key=lambda x: x[1], reverse=True))
+            user_ids = [member.id for member in ctx.guild.members]
+        async with db_new.get_session() as session:
+            top = await db_new.get_starbits_leaderboard(session, 10, user_ids)
         emb = func.Embed().title(f"Starbits Leaderboard: (Top 10 {title})")
-        for i in range(min(10, len(nm))):
+        for i, (user_id, starbits) in enumerate(top):
+            # only the users that made it onto the board are looked up
+            user = await self._get_or_fetch(ctx, user_id)
             emb.section(
-                f"{i+1}. {':crown: ' if i == 0 else ''}{list(nm.keys())[i]}",
-                f"{discord.PartialEmoji(name="starbit",id=1349479957868318810)} {list(nm.values())[i]}",
+                f"{i+1}. {':crown: ' if i == 0 else ''}{user.name}",
+                f"{discord.PartialEmoji(name="starbit",id=1349479957868318810)} {starbits}",
             )
         await ctx.send(embed=emb.embed)
 
@@ -0,0 +1,77 @@
+from discord.ext import commands, tasks
+
+import db_new
+import func
+import maintenance
+from logs import Log
+
+
+def _describe(report: maintenance.MaintenanceReport) -> str:
+    return (
+        f"Reclaimed {report.reclaimed / 1024:.0f} KiB ({report.pages_freed} pages)\n"
+        f"Analyzed {len(report.tables_analyzed)} tables, "
+        f"WAL {'truncated' if report.checkpointed else 'busy'}\n"
+        f"{report.steps} steps, longest {report.longest_step_ms:.1f} ms, "
+        f"{report.seconds:.2f}s total"
+    )
+
+
+class Maintenance(commands.Cog):
+    def __init__(self, bot):
+        self.bot: commands.Bot = bot
+        self.description = "Database Maintenance"
+        self.emoji = "🧹"
+        self.hidden = True
+
+    async def cog_load(self):
+        self.scheduled_maintenance.start()
+
+    async def cog_unload(self):
+        self.scheduled_maintenance.cancel()
+
+    @tasks.loop(minutes=maintenance.MAINTENANCE_INTERVAL)
+    async def scheduled_maintenance(self):
+        if not await maintenance.is_quiet():
+            Log["database"].debug("Skipped maintenance, the database is busy")
+            return
+        try:
+            await maintenance.maintain_all()
+        except Exception as e:
+            Log["database"].error(f"Scheduled maintenance failed: {e}")
+
+    @scheduled_maintenance.before_loop
+    async def before_scheduled_maintenance(self):
+        await self.bot.wait_until_ready()
+
+    async def _send_reports(self, ctx, title: str, reports, describe=_describe):
+        embed = func.Embed().title(title)
+        for report in reports:
+            embed.section(report.database, describe(report), False)
+        await ctx.send(embed=embed.embed, ephemeral=True)
+
+    @commands.hybrid_command("maintain")
+    @func.is_developer()
+    async def maintain(self, ctx):
+        """Vacuum, analyze and checkpoint the database now (Developer only)"""
+        await ctx.defer(ephemeral=True)
+        reports = await maintenance.maintain_all()
+        await self._send_reports(ctx, "Database Maintenance", reports)
+
+    @commands.hybrid_command("vacuum")
+    @func.is_developer()
+    async def vacuum(self, ctx):
+        """Rebuild the database files, blocking writes meanwhile (Developer only)"""
+        await ctx.defer(ephemeral=True)
+        reports = [
+            await maintenance.vacuum(database) for database in db_new.all_databases()
+        ]
+        await self._send_reports(
+            ctx,
+            "Database Vacuum",
+            reports,
+            lambda report: f"Reclaimed {report.reclaimed / 1024:.0f} KiB in {report.seconds:.2f}s",
+        )
+
+
+async def setup(bot):
+    await bot.add_cog(Maintenance(bot))
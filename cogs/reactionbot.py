@@ -1,7 +1,12 @@
+from typing import Literal
+
 import discord
 from discord.ext import commands
 
 import conf
+import func
+import pipeline
+import triggers
 from logs import Log
 
 
@@ -10,67 +15,142 @@ class ReactionBot(commands.Cog):
         self.bot: commands.Bot = bot
         self.description = "Reaction Commands"
         self.emoji = "👌"
-        self.reactdata: dict[int, bool] = {}
-
-    @commands.Cog.listener("on_ready")
-    async def on_ready(self):
-        for i in self.bot.guilds:
-            await self.load_react_data_from_persistent(i.id)
-        Log["reactions"].info(f"Loaded reaction data")
-
-    async def load_react_data_from_persistent(self, guild_id: int):
-        reaction = (await conf.get_server_config(guild_id)).get("reaction_toggle")
-        if reaction is None:
-            Log["reactions"].info(
-                f"Reaction toggle unset, defaulting to True for guild {guild_id}."
+        # compiled triggers of guilds with rules of their own, the rest use the defaults
+        self.trigger_sets: dict[int, triggers.TriggerSet] = {}
+
+    async def cog_load(self):
+        # at startup main.py warms every cog up at once, this covers (re)loading later
+        if self.bot.is_ready():
+            self.load_snapshots(await conf.load_guild_snapshots())
+        pipeline.messages.register("reactions", self.on_message, self._wants)
+
+    async def cog_unload(self):
+        pipeline.messages.unregister("reactions")
+
+    def load_snapshots(self, snapshots: dict[int, conf.GuildSnapshot]):
+        self.trigger_sets.clear()
+        for guild_id, snapshot in snapshots.items():
+            self._compile(guild_id, snapshot.triggers)
+        Log["reactions"].info(
+            f"Compiled trigger rules of {len(self.trigger_sets)} guilds"
+        )
+
+    def forget_guild(self, guild_id: int):
+        self.trigger_sets.pop(guild_id, None)
+
+    def _compile(self, guild_id: int, entries: tuple[conf.TriggerEntry, ...]):
+        if not entries:
+            self.trigger_sets.pop(guild_id, None)
+            return
+        self.trigger_sets[guild_id] = triggers.TriggerSet(
+            triggers.DEFAULT_TRIGGERS
+            + tuple(
+                triggers.Trigger(
+                    e.pattern, e.match, e.reaction, trigger_id=e.trigger_id
+                )
+                for e in entries
             )
-        else:
-            self.reactdata[guild_id] = reaction
+        )
 
-    @commands.Cog.listener("on_message")
-    async def on_message(self, message: discord.Message):
-        if message.guild is None:
+    async def _recompile(self, guild_id: int):
+        self._compile(guild_id, await conf.get_trigger_rules(guild_id))
+
+    @staticmethod
+    def _wants(features: pipeline.MessageFeatures) -> bool:
+        # DMs get logged
+        return features.settings is None or features.settings.reaction_toggle
+
+    async def on_message(self, features: pipeline.MessageFeatures):
+        message = features.message
+        if features.settings is None:
             print(
                 f"Presumably got a DM from {message.author.id} ({message.author.name}): {message.content}"
             )
             return
-        if self.reactdata.get(message.guild.id, True):
-            if "fr" in message.content.lower():
-                await message.add_reaction("🇫🇷")
-            if message.content.lower() == "ts pmo":
-                await message.add_reaction("💔")
-            if "🗿" in message.content.lower():
-                await message.add_reaction("🗿")
-            if "ok" == message.content.lower():
-                await message.add_reaction("👍")
-            if "good boy" == message.content.lower():
-                await message.add_reaction("😊")
-            if "this" == message.content.lower():
-                # check if the message is a reply and if so react to the original message
-                if message.reference and message.reference.resolved:
-                    await message.reference.resolved.add_reaction(
-                        discord.PartialEmoji(name="this", id=1346958257033445387)
-                    )
-                await message.delete()
+        trigger_set = self.trigger_sets.get(features.guild_id, triggers.DEFAULT_SET)
+        # one pass over the message, however many rules the guild has
+        for trigger in trigger_set.match(features.normalized):
+            try:
+                await self._run(message, trigger)
+            except discord.HTTPException as e:
+                # e.g. a custom emoji of a rule that was deleted since
+                Log["reactions"].warning(
+                    f"Trigger {trigger.trigger_id or trigger.pattern!r} failed: {e}"
+                )
+
+    async def _run(self, message: discord.Message, trigger: triggers.Trigger):
+        if trigger.action == triggers.REACT_TO_REPLY:
+            # check if the message is a reply and if so react to the original message
+            if message.reference and message.reference.resolved:
+                await message.reference.resolved.add_reaction(trigger.reaction)
+            await message.delete()
+        else:
+            await message.add_reaction(trigger.reaction)
 
     @commands.has_guild_permissions(manage_guild=True)
     @commands.hybrid_command("reacttoggle")
     async def toggle(self, ctx: commands.Context):
         """Toggle reactions on messages"""
-        self.reactdata[ctx.guild.id] = not await conf.get_server_reaction_toggle(
-            ctx.guild.id
-        )
-        await conf.set_server_reaction_toggle(
-            ctx.guild.id, int(self.reactdata[ctx.guild.id])
-        )
-        await ctx.send(
-            "Reactions are now "
-            + ("enabled." if self.reactdata[ctx.guild.id] else "disabled.")
+        toggle = not await conf.get_server_reaction_toggle(ctx.guild.id)
+        await conf.set_server_reaction_toggle(ctx.guild.id, int(toggle))
+        await ctx.send("Reactions are now " + ("enabled." if toggle else "disabled."))
+        Log["reactions"].info(
+            f"Toggled reactions for guild {ctx.guild.name} to {toggle}"
         )
+
+    @commands.hybrid_group("trigger")
+    async def trigger(self, ctx):
+        """Triggers, the bot reacts to messages containing or being some text."""
+        if ctx.invoked_subcommand is None:
+            await func.cmd_group_fmt(self, ctx)
+
+    @trigger.command("add")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def trigger_add(
+        self,
+        ctx: commands.Context,
+        match: Literal["contains", "exact"],
+        emoji: str,
+        *,
+        pattern: str,
+    ):
+        """React with an emoji to messages containing or being some text"""
+        pattern = triggers.normalize(pattern)
+        if not pattern:
+            await ctx.send("The text to look for can't be empty.", ephemeral=True)
+            return
+        trigger_id = await conf.add_trigger_rule(ctx.guild.id, pattern, match, emoji)
+        await self._recompile(ctx.guild.id)
+        await ctx.send(f"Added trigger {trigger_id}: {match} `{pattern}` → {emoji}")
         Log["reactions"].info(
-            f"Toggled reactions for guild {ctx.guild.name} to {self.reactdata[ctx.guild.id]}"
+            f"Added trigger {trigger_id} to guild {ctx.guild.name}: {match} {pattern!r}"
         )
 
+    @trigger.command("remove")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def trigger_remove(self, ctx: commands.Context, trigger_id: int):
+        """Remove a trigger by its ID"""
+        if not await conf.remove_trigger_rule(ctx.guild.id, trigger_id):
+            await ctx.send(f"There's no trigger {trigger_id}.", ephemeral=True)
+            return
+        await self._recompile(ctx.guild.id)
+        await ctx.send(f"Removed trigger {trigger_id}.")
+
+    @trigger.command("list")
+    async def trigger_list(self, ctx: commands.Context):
+        """List this server's triggers"""
+        emb = func.Embed().title("Triggers")
+        rules = await conf.get_trigger_rules(ctx.guild.id)
+        if not rules:
+            emb.description("No triggers set up, add one with `trigger add`.")
+        # an embed holds at most 25 fields
+        for rule in rules[:25]:
+            emb.section(
+                f"{rule.trigger_id}: {rule.match}",
+                f"`{rule.pattern}` → {rule.reaction}",
+            )
+        await ctx.send(embed=emb.embed)
+
 
 async def setup(bot):
     await bot.add_cog(ReactionBot(bot))
@@ -1,4 +1,7 @@
+import asyncio
 import json
+import os
+import time
 import traceback
 
 import discord
@@ -9,6 +12,99 @@ import db_new
 import func
 from logs import Log
 
+# Reactions are handled from raw events, so the messages don't have to be fetched
+# at startup. Fetching them only finds the ones deleted while the bot was offline.
+PREFETCH = os.getenv("REACTROLE_PREFETCH", "false").lower() == "true"
+# Channels fetched from at once, every channel is its own rate limit bucket
+PREFETCH_CONCURRENCY = int(os.getenv("REACTROLE_PREFETCH_CONCURRENCY", "4"))
+
+
+def emoji_key(emoji: str | discord.PartialEmoji) -> int | str:
+    """Returns what identifies an emoji, its ID for custom ones (they can be
+    renamed) and its text without variation selectors for unicode ones."""
+    if isinstance(emoji, str):
+        emoji = discord.PartialEmoji.from_str(emoji)
+    if emoji.id is not None:
+        return emoji.id
+    return emoji.name.replace("\ufe0f", "")
+
+
+class ReactionRoleIndex:
+    """Every reaction role by message and emoji, so reactions are handled without the database.
+
+    Attributes:
+        roles: ``{message_id: {emoji_key: role_id}}``
+        locations: ``{message_id: (guild_id, channel_id)}``, the channel is
+            ``None`` for reaction roles from before channels were stored
+    """
+
+    def __init__(self):
+        self.roles: dict[int, dict[int | str, int]] = {}
+        self.locations: dict[int, tuple[int, int | None]] = {}
+
+    def __len__(self) -> int:
+        return sum(map(len, self.roles.values()))
+
+    def load(self, snapshots: dict[int, conf.GuildSnapshot]) -> None:
+        self.roles.clear()
+        self.locations.clear()
+        for guild_id, snapshot in snapshots.items():
+            for entry in snapshot.react_roles:
+                self.add(
+                    guild_id,
+                    entry.channel_id,
+                    entry.message_id,
+                    entry.emoji,
+                    entry.role_id,
+                )
+
+    def add(
+        self,
+        guild_id: int,
+        channel_id: int | None,
+        message_id: int,
+        emoji: str,
+        role_id: int,
+    ) -> None:
+        self.roles.setdefault(message_id, {})[emoji_key(emoji)] = role_id
+        self.locations[message_id] = (guild_id, channel_id)
+
+    def get(self, message_id: int, emoji: str | discord.PartialEmoji) -> int | None:
+        """Returns the ID of the role for reacting with ``emoji`` on the message, if there is one."""
+        roles = self.roles.get(message_id)
+        if roles is None:
+            return None
+        return roles.get(emoji_key(emoji))
+
+    def remove(self, message_id: int, emoji: str) -> None:
+        roles = self.roles.get(message_id, {})
+        roles.pop(emoji_key(emoji), None)
+        if not roles:
+            self.forget_messages({message_id})
+
+    def forget_messages(self, message_ids) -> None:
+        for message_id in message_ids:
+            self.roles.pop(message_id, None)
+            self.locations.pop(message_id, None)
+
+    def forget_where(self, matches) -> None:
+        """Drops every message whose ``(guild_id, channel_id)`` location ``matches``."""
+        self.forget_messages(
+            [
+                message_id
+                for message_id, location in self.locations.items()
+                if matches(*location)
+            ]
+        )
+
+    def forget_roles(self, role_ids: set[int]) -> None:
+        for message_id, roles in list(self.roles.items()):
+            for key, role_id in list(roles.items()):
+                if role_id in role_ids:
+                    del roles[key]
+            if not roles:
+                self.forget_messages({message_id})
+
 
 class ReactionRoles(commands.Cog):
     """Reaction Roles"""
@@ -17,14 +113,111 @@ class ReactionRoles(commands.Cog):
         self.bot = bot
         self.description = "Reaction Role Commands"
         self.emoji = "🎭"
+        self.index = ReactionRoleIndex()
+        self.prefetch_task: asyncio.Task | None = None
 
     async def cog_load(self):
-        async with db_new.get_session() as session:
-            for rr in await db_new.get_reaction_roles(session):
-                rr: db_new.ReactionRole
-                chan: discord.TextChannel = self.bot.get_channel(rr.ChannelID)
-                # we dont need to do anything with this for now. just loading into discord.py cache or something
-                msg = await chan.fetch_message(rr.MessageID)
+        # at startup main.py warms every cog up at once, this covers (re)loading later
+        if self.bot.is_ready():
+            self.load_snapshots(await conf.load_guild_snapshots())
+        if PREFETCH:
+            # channels are only cached once the bot is ready, don't hold up startup for it
+            self.prefetch_task = self.bot.loop.create_task(self.prefetch_messages())
+            self.prefetch_task.add_done_callback(self._prefetch_done)
+
+    async def cog_unload(self):
+        # a reload starts a new prefetch, the old one mustn't keep going next to it
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+
+    def _prefetch_done(self, task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        Log["reactroles"].error(
+            f"Prefetching reaction role messages failed: {task.exception()!r}"
+        )
+        traceback.print_exception(task.exception())
+
+    def load_snapshots(self, snapshots: dict[int, conf.GuildSnapshot]):
+        self.index.load(snapshots)
+        Log["reactroles"].info(f"Loaded {len(self.index)} reaction roles")
+
+    def forget_guild(self, guild_id: int):
+        self.index.forget_where(lambda guild, channel: guild == guild_id)
+
+    def forget_channels(self, guild_id: int, channel_ids: set[int]):
+        self.index.forget_where(lambda guild, channel: channel in channel_ids)
+
+    def forget_roles(self, guild_id: int, role_ids: set[int]):
+        self.index.forget_roles(role_ids)
+
+    def forget_messages(self, guild_id: int, message_ids: set[int]):
+        self.index.forget_messages(message_ids)
+
+    async def prefetch_messages(self):
+        """Fetches every reaction role message once, deleting the reaction roles of messages that are gone.
+
+        Messages are grouped by channel. Up to :data:`PREFETCH_CONCURRENCY` channels are
+        worked on at once, one message at a time each, so no rate limit bucket
+        is hit by more than one request at a time.
+        """
+        await self.bot.wait_until_ready()
+        start = time.perf_counter()
+        by_channel: dict[tuple[int, int], list[int]] = {}
+        counts = {
+            "fetched": 0,
+            "deleted": 0,
+            "dead_channels": 0,
+            "no_access": 0,
+            "legacy": 0,
+        }
+        for message_id, (guild_id, channel_id) in self.index.locations.items():
+            # reaction roles from before channels were stored can't be fetched,
+            # and a missing channel mustn't get them purged, so leave them be
+            if channel_id is None or channel_id == guild_id:
+                counts["legacy"] += 1
+                continue
+            by_channel.setdefault((guild_id, channel_id), []).append(message_id)
+        channels = iter(by_channel.items())
+
+        async def worker():
+            # the workers share one iterator, each channel is taken by exactly one
+            for (guild_id, channel_id), message_ids in channels:
+                await self._prefetch_channel(guild_id, channel_id, message_ids, counts)
+
+        await asyncio.gather(*(worker() for _ in range(PREFETCH_CONCURRENCY)))
+        Log["reactroles"].info(
+            f"Prefetched reaction role messages in {len(by_channel)} channels"
+            f" in {time.perf_counter() - start:.1f}s: {counts}"
+        )
+
+    async def _prefetch_channel(
+        self, guild_id: int, channel_id: int, message_ids: list[int], counts: dict
+    ):
+        guild = self.bot.get_guild(guild_id)
+        channel = guild.get_channel_or_thread(channel_id) if guild else None
+        if channel is None:
+            # maybe an archived thread, the cleanup cog's reconciler checks those
+            counts["dead_channels"] += 1
+            return
+        gone = set()
+        for message_id in message_ids:
+            try:
+                await channel.fetch_message(message_id)
+                counts["fetched"] += 1
+            except discord.NotFound:
+                gone.add(message_id)
+            except discord.Forbidden:
+                counts["no_access"] += 1
+                break
+            except discord.HTTPException as e:
+                Log["reactroles"].warning(f"Couldn't fetch message {message_id}: {e}")
+        if gone:
+            deleted = await db_new.write_guild(
+                guild_id, db_new.delete_reaction_roles_by_messages, gone
+            )
+            counts["deleted"] += deleted
+            self.index.forget_messages(gone)
 
     @commands.hybrid_group("reactrole", aliases=["rr", "rrole"])
     async def rr(self, ctx):
@@ -38,73 +231,86 @@ class ReactionRoles(commands.Cog):
         self, ctx, role: discord.Role, emoji: str
     ):  # TODO: add check to see if emoji provided is actually an emoji
         """Create new ReactRole"""
-        async with db_new.get_session() as session:
-            if ctx.message.reference is None:
-                raise Exception(
-                    "Needs to be a reply to an already existing message."
-                )  # TODO: maybe make this its own exception?
-            message: discord.Message = await ctx.channel.fetch_message(
-                ctx.message.reference.message_id
-            )  # make sure the shit is cached
-            await db_new.create_reaction_role(
-                session, ctx.guild.id, message.id, role.id, emoji
-            )
-            await message.add_reaction(emoji)
-            await ctx.message.delete()
-            await ctx.send(
-                "Success", delete_after=3
-            )  # write a simple success message and delete after a set time (3s)
+        if ctx.message.reference is None:
+            raise Exception(
+                "Needs to be a reply to an already existing message."
+            )  # TODO: maybe make this its own exception?
+        message: discord.Message = await ctx.channel.fetch_message(
+            ctx.message.reference.message_id
+        )  # make sure the shit is cached
+        await db_new.write_guild(
+            ctx.guild.id,
+            db_new.create_reaction_role,
+            ctx.guild.id,
+            ctx.channel.id,
+            message.id,
+            role.id,
+            emoji,
+        )
+        self.index.add(ctx.guild.id, ctx.channel.id, message.id, emoji, role.id)
+        await message.add_reaction(emoji)
+        await ctx.message.delete()
+        await ctx.send(
+            "Success", delete_after=3
+        )  # write a simple success message and delete after a set time (3s)
+
+    async def _reaction_role(
+        self, payload: discord.RawReactionActionEvent
+    ) -> tuple[discord.Guild, discord.Role] | None:
+        # the common case, a reaction on any other message, is a dict lookup
+        role_id = self.index.get(payload.message_id, payload.emoji)
+        if role_id is None or payload.user_id == self.bot.user.id:
+            return None
+        guild = self.bot.get_guild(payload.guild_id)
+        role = guild.get_role(role_id) if guild else None
+        if role is None:
+            Log["reactroles"].error(f"Role {role_id} not found")
+            return None
+        return guild, role
 
     @commands.Cog.listener()
-    async def on_reaction_add(self, reaction: discord.Reaction, user: discord.Member):
-        print("baller")  # prints 'baller' if the reaction actually gets registered.
-        if user.id == self.bot.user.id:
-            Log["reactroles"].info("Reaction is performed by me. Aborting.")
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        found = await self._reaction_role(payload)
+        if found is None:
             return
-        async with db_new.get_session() as session:
-            rrole = await db_new.get_reaction_role_by_emoji_and_message(
-                session, reaction.message.id, reaction.emoji
-            )
-            if rrole is not None:
-                role = reaction.message.guild.get_role(rrole.RoleID)
-                if role:
-                    await user.add_roles(role)
-                    Log["reactroles"].info(f"Added role {role.name} to {user.name}")
-                else:
-                    Log["reactroles"].error(f"Role {rrole.RoleID} not found")
+        _, role = found
+        await payload.member.add_roles(role)
+        Log["reactroles"].info(f"Added role {role.name} to {payload.member.name}")
 
     @commands.Cog.listener()
-    async def on_reaction_remove(
-        self, reaction: discord.Reaction, user: discord.Member
-    ):
-        if user.id == self.bot.user.id:
-            Log["reactroles"].info("Reaction is performed by me. Aborting.")
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        found = await self._reaction_role(payload)
+        if found is None:
             return
-        async with db_new.get_session() as session:
-            rrole = await db_new.get_reaction_role_by_emoji_and_message(
-                session, reaction.message.id, reaction.emoji
-            )
-            if rrole is not None:
-                role = reaction.message.guild.get_role(rrole.RoleID)
-                if role:
-                    await user.remove_roles(role)
-                    Log["reactroles"].info(f"Removed role {role.name} from {user.name}")
-                else:
-                    Log["reactroles"].error(f"Role {rrole.RoleID} not found")
+        guild, role = found
+        # removal events carry no member, but with the members intent they're cached
+        member = guild.get_member(payload.user_id)
+        if member is None:
+            try:
+                member = await guild.fetch_member(payload.user_id)
+            except discord.NotFound:
+                return  # they left the guild, taking the role with them
+        await member.remove_roles(role)
+        Log["reactroles"].info(f"Removed role {role.name} from {member.name}")
 
     @rr.command("remove")
     async def remove(self, ctx, message_id, emoji):
         """Remove a ReactRole"""
-        async with db_new.get_session() as session:  # TODO: SOMEONE PLEASE CHANGE THIS
+        async with db_new.get_session(
+            ctx.guild.id
+        ) as session:  # TODO: SOMEONE PLEASE CHANGE THIS
             rroleid = await db_new.get_reaction_role_by_emoji_and_message(
                 session, message_id, emoji
             )
-            await db_new.delete_reaction_role(session, rroleid.ReactRoleID)
+        await db_new.write_guild(
+            ctx.guild.id, db_new.delete_reaction_role, rroleid.ReactRoleID
+        )
+        self.index.remove(rroleid.MessageID, emoji)
 
     @rr.command("list")
     async def list(self, ctx, channel: discord.TextChannel):
         """List existing ReactRoles in a channel"""
-        async with db_new.get_session() as session:
+        async with db_new.get_session(ctx.guild.id) as session:
             reactlist = await db_new.get_reaction_roles_by_channel(session, channel.id)
             emb = (
                 func.Embed()
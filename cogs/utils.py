@@ -11,8 +11,11 @@ import requests
 from discord import app_commands
 from discord.ext import commands
 
+import cache
 import conf
+import dbstats
 import func
+import pipeline
 
 
 class HelpCategorySelection(discord.ui.Select):
@@ -294,7 +297,13 @@ class Utils(commands.Cog):
     @commands.hybrid_command("sql")
     @func.is_developer()
     async def sql(self, ctx, *, query: str, commit=True):
-        """Execute SQL query (Developer only)"""
+        """Execute SQL query (Developer only)
+
+        Opens database.db directly, around the single writer and without its
+        busy timeout, so it can fail with "database is locked" while the bot
+        writes. It only reaches the main file, with DB_SHARDS set the
+        guild-scoped tables live in the shard files.
+        """
         async with aiosqlite.connect("database.db") as conn:
             async with conn.cursor() as c:
                 await c.execute(query)
@@ -307,6 +316,88 @@ class Utils(commands.Cog):
                 )
                 if commit:
                     await conn.commit()
+                    # the query went around db_new, so nothing cached can be trusted anymore
+                    cache.clear_all()
+                    await conf.load_starbits_ranking()
+                    await conf.load_cog_snapshots(self.bot)
+
+    @commands.hybrid_command("cachestats")
+    @func.is_developer()
+    async def cachestats(self, ctx):
+        """Show config cache hit rates (Developer only)"""
+        embed = func.Embed().title("Cache Stats")
+        for c in cache.caches:
+            stats = c.stats()
+            embed.section(
+                stats["name"],
+                f"{stats['size']}/{stats['maxsize']} entries\n"
+                f"{stats['hits']} hits, {stats['misses']} misses "
+                f"({stats['hit_rate']:.1%})",
+            )
+        await ctx.send(embed=embed.embed, ephemeral=True)
+
+    @commands.hybrid_command("dbstats")
+    @func.is_developer()
+    async def dbstats(self, ctx, reset: bool = False):
+        """Show database latency stats, optionally resetting them (Developer only)"""
+
+        def fmt(summary: dict) -> str:
+            return (
+                f"{summary['count']}x, p50 {summary['p50_ms']:.2f} ms, "
+                f"p95 {summary['p95_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms"
+            )
+
+        stats = dbstats.stats
+        embed = (
+            func.Embed()
+            .title("Database Stats")
+            .description(
+                f"Since <t:{round(stats.since)}:R>, "
+                f"{stats.slow_queries} queries over {dbstats.SLOW_QUERY_MS:g} ms"
+            )
+            .section("Session hold time", fmt(stats.sessions.summary()), False)
+            .section("Write lock wait", fmt(stats.lock_waits.summary()), False)
+        )
+        for template, summary in stats.top(8):
+            embed.section(
+                f"{summary['total_ms']:.0f} ms total",
+                f"```sql\n{template[:800]}```{fmt(summary)}",
+                False,
+            )
+        await ctx.send(embed=embed.embed, ephemeral=True)
+        if reset:
+            stats.reset()
+
+    @commands.hybrid_command("msgstats")
+    @func.is_developer()
+    async def msgstats(self, ctx, reset: bool = False):
+        """Show what every message feature costs per message, optionally resetting it (Developer only)"""
+
+        def fmt(summary: dict) -> str:
+            return (
+                f"{summary['count']}x, {summary['total_ms']:.0f} ms total\n"
+                f"p50 {summary['p50_ms']:.2f} ms, p95 {summary['p95_ms']:.2f} ms, "
+                f"p99 {summary['p99_ms']:.2f} ms"
+            )
+
+        messages = pipeline.messages
+        embed = (
+            func.Embed()
+            .title("Message Stats")
+            .description(f"Since <t:{round(messages.since)}:R>")
+            .section("Feature extraction", fmt(messages.extraction.summary()), False)
+        )
+        for consumer in sorted(
+            messages.consumers.values(), key=lambda c: c.timings.total, reverse=True
+        ):
+            embed.section(
+                consumer.name,
+                f"{fmt(consumer.timings.summary())}\n{consumer.skipped} skipped",
+                False,
+            )
+        await ctx.send(embed=embed.embed, ephemeral=True)
+        if reset:
+            messages.reset()
 
     @commands.hybrid_command("gitpull")
     @func.is_developer()
@@ -1,8 +1,10 @@
+import collections
 import json
 
 import discord
 from discord.ext import commands
 
+import conf
 import db_new
 import func
 from logs import Log
@@ -58,13 +60,44 @@ class Voice(commands.Cog):
         self.description = "Voice chat shenanigans including music and sfx"
         self.emoji = "🎵"
         self.voice_data: dict[int, GuildData] = {}
+        # how on_voice_state_update handled its events, "fast_path" ones needed no I/O
+        self.event_counts = collections.Counter()
 
-    async def on_load(self):
-        async for guild in self.bot.fetch_guilds():
-            await self.load_voice_data_from_persistent(guild.id)
-            Log["voice"].info(
-                f"Config for guild {guild.name}: has been loaded successfully: {self.voice_data[guild.id]}"
+    async def cog_load(self):
+        # at startup main.py warms every cog up at once, this covers (re)loading later
+        if self.bot.is_ready():
+            self.load_snapshots(await conf.load_guild_snapshots())
+            await self.on_ready()
+
+    def load_snapshots(self, snapshots: dict[int, conf.GuildSnapshot]):
+        for guild_id, snapshot in snapshots.items():
+            self.voice_data[guild_id] = GuildData(
+                guild_id,
+                generator_id=snapshot.voice_creation_channel_id,
+                channels=list(snapshot.temp_channels),
             )
+        Log["voice"].info(f"Loaded voice config for {len(snapshots)} guilds")
+
+    def forget_guild(self, guild_id: int):
+        self.voice_data.pop(guild_id, None)
+
+    def forget_channels(self, guild_id: int, channel_ids: set[int]):
+        config = self.voice_data.get(guild_id)
+        if config is None:
+            return
+        config.channels = [c for c in config.channels if c not in channel_ids]
+        if config.generator_id in channel_ids:
+            config.generator_id = None
+
+    @commands.Cog.listener("on_ready")
+    async def on_ready(self):
+        # guilds without stored config still need an entry for their music queue
+        for guild in self.bot.guilds:
+            self.get_or_create_default_cache_entry(guild)
+
+    @commands.Cog.listener("on_guild_join")
+    async def on_guild_join(self, guild: discord.Guild):
+        self.get_or_create_default_cache_entry(guild)
 
     @commands.hybrid_group("voice", description="Voice command group")
     async def voice(self, ctx):
@@ -72,28 +105,19 @@ class Voice(commands.Cog):
         if ctx.invoked_subcommand is None:
             await func.cmd_group_fmt(self, ctx)
 
-    async def load_voice_data_from_persistent(self, guild_id: int):
-        async with db_new.get_session() as session:
-            server_config = await db_new.get_server_config_or_default(session, guild_id)
-            voice_generator_channel_id = server_config.VoiceCreationChannelID
-            if voice_generator_channel_id is None:
-                Log["voice"].warning(
-                    f"Voice generator channel not found for guild {guild_id}. Caching as None."
-                )
-            self.voice_data[guild_id] = GuildData(
-                guild_id, generator_id=voice_generator_channel_id
-            )
-
     def get_or_create_default_cache_entry(self, guild: discord.Guild):
         if guild.id not in self.voice_data:
             self.voice_data[guild.id] = GuildData(guild)
         return self.voice_data[guild.id]
 
     async def set_voice_generator_channel(self, guild_id: int, channel_id: int):
-        async with db_new.get_session() as session:
-            await db_new.update_server_config(
-                session, guild_id, VoiceCreationChannelID=channel_id
-            )
+        await db_new.write_guild(
+            guild_id,
+            db_new.update_server_config,
+            guild_id,
+            VoiceCreationChannelID=channel_id,
+        )
+        self.voice_data.setdefault(guild_id, GuildData(guild_id))
         self.voice_data[guild_id].generator_id = channel_id
 
     @voice.command("info")
@@ -123,10 +147,9 @@ class Voice(commands.Cog):
         if name is None:
             name = f"{ctx.author.display_name}'s Voice"
 
-        async with db_new.get_session() as session:
-            await db_new.update_user_config(
-                session, ctx.author.id, TempVoiceChannelName=name
-            )
+        await db_new.write(
+            db_new.update_user_config, ctx.author.id, TempVoiceChannelName=name
+        )
 
         config = self.get_or_create_default_cache_entry(ctx.guild)
 
@@ -146,14 +169,20 @@ class Voice(commands.Cog):
     ):
         guild = member.guild
         config = self.get_or_create_default_cache_entry(guild)
-        # changed so the bot just makes a channel with your name instead of it being preconfigured change with temprename still
-        async with db_new.get_session() as session:
-            user_config = await db_new.get_user_config_or_default(session, member.id)
-            if user_config.TempVoiceChannelName is not None:
-                channame = user_config.TempVoiceChannelName
-            else:
-                channame = f"{member.display_name}'s Voice"
-        if after.channel and after.channel.id == config.generator_id:
+        # Mute, deafen, stream and video toggles keep the channel, and most
+        # moves don't involve a generator or temp channel. Both are decided
+        # from the cached config alone, without touching the database.
+        before_id = before.channel.id if before.channel else None
+        after_id = after.channel.id if after.channel else None
+        creates = after_id is not None and after_id == config.generator_id
+        leaves_temp = before_id in config.channels and before_id != after_id
+        if not creates and not leaves_temp:
+            self.event_counts["fast_path"] += 1
+            return
+        if creates:
+            # changed so the bot just makes a channel with your name instead of it being preconfigured change with temprename still
+            user_config = await conf.get_user_config(member.id)
+            channame = user_config.chan_name or f"{member.display_name}'s Voice"
             channel = await member.guild.create_voice_channel(
                 name=channame, category=after.channel.category
             )
@@ -162,15 +191,42 @@ class Voice(commands.Cog):
                 member, move_members=True, manage_channels=True
             )  # hopefully doesn't backfire, gives the owner of the tempchannel more control.
             config.channels.append(channel.id)
+            await db_new.write_guild(
+                guild.id, db_new.create_temp_channel, guild.id, channel.id
+            )
+            self.event_counts["created"] += 1
             Log["voice"].info(f"Created voice channel for {member.display_name}")
-        if before.channel and before.channel.id in config.channels:
-            if after.channel and after.channel.id == before.channel.id:
-                # User did not leave, so we don't give a fuck
-                return
+        if leaves_temp:
             if len(before.channel.members) == 0:
                 config.channels.remove(before.channel.id)
                 await before.channel.delete()
+                await db_new.write_guild(
+                    guild.id, db_new.delete_temp_channel, before.channel.id
+                )
+                self.event_counts["deleted"] += 1
                 Log["voice"].info(f"Deleted voice channel: {before.channel.name}")
+            else:
+                self.event_counts["left_occupied"] += 1
+
+    @voice.command("stats")
+    @func.is_developer()
+    async def vstats(self, ctx):
+        """Show how voice state updates were handled (Developer only)"""
+        total = sum(self.event_counts.values())
+        fast = self.event_counts["fast_path"]
+        await ctx.send(
+            embed=func.Embed()
+            .title("Voice State Updates")
+            .description(
+                f"{total} events, {fast} on the fast path"
+                f" ({fast / total if total else 0:.1%})\n"
+                + "\n".join(
+                    f"{name}: {count}" for name, count in self.event_counts.items()
+                )
+            )
+            .embed,
+            ephemeral=True,
+        )
 
     async def _join(self, ctx):
         try:
@@ -370,6 +426,4 @@ class Voice(commands.Cog):
 
 
 async def setup(bot):
-    v = Voice(bot)
-    await bot.add_cog(v)
-    await v.on_load()
+    await bot.add_cog(Voice(bot))
@@ -19,10 +19,12 @@ class ChannelSelectDropdown(discord.ui.ChannelSelect):
     async def callback(self, interaction: discord.Interaction):
         channel = interaction.data["values"][0]
         try:
-            async with db_new.get_session() as session:
-                await db_new.update_server_config(
-                    session, interaction.guild.id, WelcomeChannelID=channel
-                )
+            await db_new.write_guild(
+                interaction.guild.id,
+                db_new.update_server_config,
+                interaction.guild.id,
+                WelcomeChannelID=channel,
+            )
         except Exception as e:
             traceback.print_exception(type(e), e, e.__traceback__)
             await interaction.response.send_message(
@@ -63,7 +65,6 @@ class Welcomer(commands.Cog):
         self.bot = bot
         self.description = "Join and Leave Announcements and Settings"
         self.emoji = "👋"
-        self.channel_cache = {}
 
     @commands.hybrid_group("welcome")
     async def welcome(self, ctx):
@@ -75,10 +76,8 @@ class Welcomer(commands.Cog):
     async def _setup(self, ctx):
         """Setup the Welcome Bot"""
         await ctx.defer(ephemeral=True)
-        existing_config = await conf.get_server_config(ctx.guild.id)
-        welcome_channel_id = existing_config.get("welcome_channel_id", None)
-        if welcome_channel_id is not None:
-            self.channel_cache[ctx.guild.id] = welcome_channel_id
+        server_config = await conf.get_server_config(ctx.guild.id)
+        if server_config.welcome_channel_id is not None:
             setup_embed = (
                 func.Embed()
                 .color(0x11111B)
@@ -103,10 +102,12 @@ class Welcomer(commands.Cog):
     @welcome.command("reset")
     async def reset(self, ctx):
         """Reset the Welcome Bot"""
-        async with db_new.get_session() as session:
-            await db_new.update_server_config(
-                session, ctx.guild.id, WelcomeChannelID=None
-            )
+        await db_new.write_guild(
+            ctx.guild.id,
+            db_new.update_server_config,
+            ctx.guild.id,
+            WelcomeChannelID=None,
+        )
         await ctx.send("Welcome bot has been reset.")
 
     @commands.Cog.listener()
@@ -115,23 +116,15 @@ class Welcomer(commands.Cog):
         await dmchan.send(  # send the user a message saying welcome
             f"Welcome to {member.guild.name} {member.mention}!\nThis server is powered by {self.bot.user.mention}. You can find commands by running `/help`.\n\nHave a great time!\n-# Oh yeah also, I'm open source! [github](<https://github.com/spelis/lunabot>)"
         )
-        welcome_channel_id: int
-        if member.guild.id in self.channel_cache:
-            welcome_channel_id = self.channel_cache[member.guild.id]
-        else:
-            existing_config = await conf.get_server_config(member.guild.id)
-            welcome_channel_id = existing_config.get("welcome_channel_id", None)
-            if welcome_channel_id is not None:
-                self.channel_cache[member.guild.id] = welcome_channel_id
-            else:
-                # No welcome channel is set up
-                print("Welcome channel is not set up")
-                return
+        server_config = await conf.get_server_config(member.guild.id)
+        welcome_channel_id = server_config.welcome_channel_id
+        if welcome_channel_id is None:
+            # No welcome channel is set up
+            print("Welcome channel is not set up")
+            return
         welcome_channel = member.guild.get_channel_or_thread(welcome_channel_id)
         if welcome_channel is None:
             # Welcome channel is set up, but is invalid
-            # We don't invalidate cache, since that'd just make us fetch it from the database every time someone joins.
-            # It's faster to just check against a dict.
             print("Welcome channel is invalid")
             return
         await welcome_channel.send(
@@ -1,6 +1,85 @@
+from dataclasses import dataclass
 from datetime import datetime, timezone
 
+import cache
 import db_new
+import ranking
+
+
+@dataclass(frozen=True, slots=True)
+class ReactRoleEntry:
+    message_id: int
+    # None for reaction roles created before channels were stored
+    channel_id: int | None
+    emoji: str
+    role_id: int
+
+
+@dataclass(frozen=True, slots=True)
+class TriggerEntry:
+    trigger_id: int
+    pattern: str
+    match: str
+    reaction: str
+
+
+@dataclass(frozen=True, slots=True)
+class ServerSettings:
+    """A server's config, detached from the database session.
+
+    Attributes:
+        guild_id: ID of the guild.
+        welcome_channel_id: Channel for welcome messages, if set up.
+        voice_creation_channel_id: Voice channel that generates temp channels, if set up.
+        reaction_toggle: Whether the bot reacts to messages.
+    """
+
+    guild_id: int
+    welcome_channel_id: int | None
+    voice_creation_channel_id: int | None
+    reaction_toggle: bool
+
+
+@dataclass(frozen=True, slots=True)
+class UserSettings:
+    """A user's config, detached from the database session.
+
+    Attributes:
+        user_id: ID of the user.
+        chan_name: Name for the user's temporary voice channels, if set.
+        starbits: The user's balance.
+        starbits_next_collect: Timestamp of the next time the user can claim starbits.
+    """
+
+    user_id: int
+    chan_name: str | None
+    starbits: int
+    starbits_next_collect: float
+
+
+@dataclass(frozen=True, slots=True)
+class GuildSnapshot:
+    """Everything stored about a guild, read at one point in time.
+
+    Attributes:
+        guild_id: ID of the guild.
+        welcome_channel_id: Channel for welcome messages, if set up.
+        voice_creation_channel_id: Voice channel that generates temp channels, if set up.
+        reaction_toggle: Whether the bot reacts to messages.
+        welcome_roles: IDs of the roles given to new members.
+        react_roles: The guild's reaction roles.
+        temp_channels: IDs of the guild's active temporary voice channels.
+        triggers: The guild's own trigger rules, oldest first.
+    """
+
+    guild_id: int
+    welcome_channel_id: int | None
+    voice_creation_channel_id: int | None
+    reaction_toggle: bool
+    welcome_roles: tuple[int, ...]
+    react_roles: tuple[ReactRoleEntry, ...]
+    temp_channels: tuple[int, ...]
+    triggers: tuple[TriggerEntry, ...] = ()
 
 
 async def create_schema() -> None:
@@ -8,122 +87,395 @@ async def create_schema() -> None:
 
 
 async def set_server_welcome_channel(guild_id: int, welcome_channel_id: int) -> None:
-    async with db_new.get_session() as session:
-        await db_new.update_server_config(
-            session, guild_id, WelcomeChannelID=welcome_channel_id
-        )
+    await db_new.write_guild(
+        guild_id,
+        db_new.update_server_config,
+        guild_id,
+        WelcomeChannelID=welcome_channel_id,
+    )
 
 
 async def set_server_voice_creation_channel(
     guild_id: int, voice_creation_channel_id: int
 ) -> None:
-    async with db_new.get_session() as session:
-        await db_new.update_server_config(
-            session, guild_id, VoiceCreationChannelID=voice_creation_channel_id
-        )
+    await db_new.write_guild(
+        guild_id,
+        db_new.update_server_config,
+        guild_id,
+        VoiceCreationChannelID=voice_creation_channel_id,
+    )
 
 
 async def set_server_reaction_toggle(guild_id: int, reaction_toggle: bool) -> None:
-    async with db_new.get_session() as session:
-        await db_new.update_server_config(
-            session, guild_id, ReactionToggle=reaction_toggle
-        )
+    await db_new.write_guild(
+        guild_id, db_new.update_server_config, guild_id, ReactionToggle=reaction_toggle
+    )
 
 
-async def get_server_reaction_toggle(guild_id: int) -> None:
-    async with db_new.get_session() as session:
-        return (
-            await db_new.get_server_config_or_default(session, guild_id)
-        ).ReactionToggle
+async def get_server_reaction_toggle(guild_id: int) -> bool:
+    return (await get_server_config(guild_id)).reaction_toggle
 
 
 async def get_welcome_roles(guild_id: int) -> list[int]:
-    async with db_new.get_session() as session:
+    async with db_new.get_session(guild_id) as session:
         return [
             r.RoleID for r in await db_new.get_auto_roles_by_guild(session, guild_id)
         ]
 
 
-async def set_welcome_roles(guild_id: int, welcome_roles: list[int]) -> None:
+async def add_auto_role(guild_id: int, role_id: int) -> bool:
+    """
+    Adds one welcome role to a server, unless it's already there.
+
+    The check and the insert are one write, so concurrent adds can't duplicate
+    the role or undo each other.
+
+    Returns:
+        bool: Whether the role was added.
     """
-    Sets the welcome roles for a server.
+    return await db_new.write_guild(guild_id, _add_auto_role, guild_id, role_id)
+
+
+async def _add_auto_role(
+    session: db_new.AsyncSession, guild_id: int, role_id: int
+) -> bool:
+    existing = {
+        r.RoleID for r in await db_new.get_auto_roles_by_guild(session, guild_id)
+    }
+    if role_id in existing:
+        return False
+    await db_new.create_auto_roles(session, guild_id, [role_id])
+    return True
+
+
+async def delete_auto_role(guild_id: int, role_id: int) -> bool:
+    """
+    Removes one welcome role from a server.
+
+    Returns:
+        bool: Whether the server had the role.
+    """
+    deleted = await db_new.write_guild(
+        guild_id, db_new.delete_auto_roles, guild_id, [role_id]
+    )
+    return deleted > 0
+
+
+async def get_guild_snapshot(guild_id: int) -> GuildSnapshot:
+    """
+    Loads a guild's config, auto roles, reaction roles, temp channels and trigger rules in one session.
 
     Args:
         guild_id (int): ID of the server.
-        welcome_roles (list[int]): List of role IDs to set as welcome roles.
 
     Returns:
-        None
+        GuildSnapshot: The guild's stored data, with defaults if it has no config.
     """
-    async with db_new.get_session() as session:
-        existing = [
-            r.RoleID for r in await db_new.get_auto_roles_by_guild(session, guild_id)
-        ]
-        for role_id in welcome_roles:
-            if role_id in existing:
-                continue
-            await db_new.create_auto_role(session, guild_id, role_id)
+    async with db_new.get_session(guild_id) as session:
+        server_config = await db_new.get_server_config(session, guild_id)
+        if server_config is None:
+            server_config = db_new.ServerConfig(ServerID=guild_id)
+        auto_roles = await db_new.get_auto_roles_by_guild(session, guild_id)
+        reaction_roles = await db_new.get_reaction_roles_by_guild(session, guild_id)
+        temp_channels = await db_new.get_active_temp_channels(session, guild_id)
+        trigger_rules = await db_new.get_trigger_rules_by_guild(session, guild_id)
+        return GuildSnapshot(
+            guild_id=guild_id,
+            welcome_channel_id=server_config.WelcomeChannelID,
+            voice_creation_channel_id=server_config.VoiceCreationChannelID,
+            reaction_toggle=server_config.ReactionToggle,
+            welcome_roles=tuple(r.RoleID for r in auto_roles),
+            react_roles=tuple(
+                ReactRoleEntry(r.MessageID, r.ChannelID, r.Emoji, r.RoleID)
+                for r in reaction_roles
+            ),
+            temp_channels=tuple(t.ChannelID for t in temp_channels),
+            triggers=tuple(
+                TriggerEntry(t.TriggerID, t.Pattern, t.Match, t.Reaction)
+                for t in trigger_rules
+            ),
+        )
 
 
-async def get_server_config(guild_id: int) -> dict:
-    async with db_new.get_session() as session:
-        server_config = await db_new.get_server_config_or_default(session, guild_id)
-        return {
-            "guild_id": server_config.ServerID,
-            "welcome_channel_id": server_config.WelcomeChannelID,
-            "voice_creation_channel_id": server_config.VoiceCreationChannelID,
-            "reaction_toggle": server_config.ReactionToggle,
-            "welcome_roles": await get_welcome_roles(guild_id),
-            "react_roles": await get_reactroles(guild_id),
-        }
-
-
-async def get_user_config(user_id: int) -> dict:
-    async with db_new.get_session() as session:
-        user_data = await db_new.get_user_config_or_default(session, user_id)
-        return {
-            "ChanName": user_data.TempVoiceChannelName,
-            "Starbits": user_data.Starbits,
-            "StarbitsNextCollect": user_data.StarbitsNext.timestamp(),
-        }
+async def load_guild_snapshots() -> dict[int, GuildSnapshot]:
+    """
+    Loads the snapshot of every guild with stored data, streaming each table once.
+
+    Guilds without any stored data are left out, their snapshot is all defaults.
 
+    Returns:
+        dict[int, GuildSnapshot]: Snapshots keyed by guild ID.
+    """
+    configs = {}
+    welcome_roles: dict[int, list[int]] = {}
+    react_roles: dict[int, list[ReactRoleEntry]] = {}
+    temp_channels: dict[int, list[int]] = {}
+    trigger_rules: dict[int, list[TriggerEntry]] = {}
+    ServerConfig = db_new.ServerConfig
+    ReactionRole = db_new.ReactionRole
+    TriggerRule = db_new.TriggerRule
+    # with sharding on, every shard holds a disjoint set of guilds
+    for database in db_new.guild_databases():
+        async with database.session() as session:
+            async for row in db_new.stream_columns(
+                session,
+                ServerConfig.ServerID,
+                ServerConfig.WelcomeChannelID,
+                ServerConfig.VoiceCreationChannelID,
+                ServerConfig.ReactionToggle,
+            ):
+                configs[row[0]] = row
+            async for guild_id, role_id in db_new.stream_columns(
+                session, db_new.AutoRole.GuildID, db_new.AutoRole.RoleID
+            ):
+                welcome_roles.setdefault(guild_id, []).append(role_id)
+            async for guild_id, *entry in db_new.stream_columns(
+                session,
+                ReactionRole.GuildID,
+                ReactionRole.MessageID,
+                ReactionRole.ChannelID,
+                ReactionRole.Emoji,
+                ReactionRole.RoleID,
+            ):
+                react_roles.setdefault(guild_id, []).append(ReactRoleEntry(*entry))
+            async for guild_id, channel_id in db_new.stream_columns(
+                session, db_new.TempChannel.GuildID, db_new.TempChannel.ChannelID
+            ):
+                temp_channels.setdefault(guild_id, []).append(channel_id)
+            async for guild_id, *entry in db_new.stream_columns(
+                session,
+                TriggerRule.GuildID,
+                TriggerRule.TriggerID,
+                TriggerRule.Pattern,
+                TriggerRule.Match,
+                TriggerRule.Reaction,
+            ):
+                trigger_rules.setdefault(guild_id, []).append(TriggerEntry(*entry))
 
-async def get_reactroles(guildid: int) -> list[dict]:
+    snapshots = {}
+    # guilds without a config row are cached as defaults too, saving a lookup later
+    for guild_id in (
+        configs.keys()
+        | welcome_roles.keys()
+        | react_roles.keys()
+        | temp_channels.keys()
+        | trigger_rules.keys()
+    ):
+        _, welcome_channel_id, voice_creation_channel_id, reaction_toggle = configs.get(
+            guild_id, (guild_id, None, None, True)
+        )
+        snapshots[guild_id] = GuildSnapshot(
+            guild_id=guild_id,
+            welcome_channel_id=welcome_channel_id,
+            voice_creation_channel_id=voice_creation_channel_id,
+            reaction_toggle=reaction_toggle,
+            welcome_roles=tuple(welcome_roles.get(guild_id, ())),
+            react_roles=tuple(react_roles.get(guild_id, ())),
+            temp_channels=tuple(temp_channels.get(guild_id, ())),
+            # the stream isn't ordered, snapshots list the rules oldest first
+            triggers=tuple(
+                sorted(trigger_rules.get(guild_id, ()), key=lambda t: t.trigger_id)
+            ),
+        )
+        cache.server_configs.set(
+            guild_id,
+            ServerSettings(
+                guild_id, welcome_channel_id, voice_creation_channel_id, reaction_toggle
+            ),
+        )
+    return snapshots
+
+
+async def load_cog_snapshots(bot) -> int:
+    """
+    Loads every guild's snapshot once and hands them to each cog with a ``load_snapshots`` method.
+
+    Returns:
+        int: The number of guilds with stored data.
+    """
+    snapshots = await load_guild_snapshots()
+    for cog in bot.cogs.values():
+        if hasattr(cog, "load_snapshots"):
+            cog.load_snapshots(snapshots)
+    return len(snapshots)
+
+
+async def get_server_config(guild_id: int) -> ServerSettings:
+    """
+    Gets a server's config, from the shared cache if possible.
+
+    The cache is invalidated whenever the config is committed, so this is
+    always at least as fresh as the last write.
+    """
+    return await cache.server_configs.get_or_load(guild_id, _server_config_loader.load)
+
+
+async def _load_server_configs(guild_ids: list[int]) -> dict[int, ServerSettings]:
+    loaded = {}
+    for database, shard_guild_ids in db_new.group_by_database(guild_ids).items():
+        async with database.session() as session:
+            server_configs = await db_new.get_server_configs(session, shard_guild_ids)
+            for guild_id in shard_guild_ids:
+                server_config = server_configs.get(guild_id) or db_new.ServerConfig(
+                    ServerID=guild_id
+                )
+                loaded[guild_id] = ServerSettings(
+                    guild_id,
+                    server_config.WelcomeChannelID,
+                    server_config.VoiceCreationChannelID,
+                    server_config.ReactionToggle,
+                )
+    return loaded
+
+
+# cache misses within one event loop tick share a single query
+_server_config_loader = cache.BatchLoader(_load_server_configs)
+
+
+async def get_user_config(user_id: int) -> UserSettings:
+    """
+    Gets a user's config, from the shared cache if possible.
+
+    The cache is invalidated whenever the config is committed, so this is
+    always at least as fresh as the last write.
+    """
+    return await cache.user_configs.get_or_load(user_id, _user_config_loader.load)
+
+
+async def _load_user_configs(user_ids: list[int]) -> dict[int, UserSettings]:
     async with db_new.get_session() as session:
-        return [
-            {
-                "message_id": r.MessageID,
-                "emoji": r.Emoji,
-                "role_id": r.RoleID,
-            }
+        user_configs = await db_new.get_user_configs(session, user_ids)
+        loaded = {}
+        for user_id in user_ids:
+            user_data = user_configs.get(user_id) or db_new.UserConfig(UserID=user_id)
+            loaded[user_id] = UserSettings(
+                user_id,
+                user_data.TempVoiceChannelName,
+                user_data.Starbits,
+                user_data.StarbitsNext.timestamp(),
+            )
+        return loaded
+
+
+# cache misses within one event loop tick share a single query
+_user_config_loader = cache.BatchLoader(_load_user_configs)
+
+
+async def get_reactroles(guildid: int) -> tuple[ReactRoleEntry, ...]:
+    async with db_new.get_session(guildid) as session:
+        return tuple(
+            ReactRoleEntry(r.MessageID, r.ChannelID, r.Emoji, r.RoleID)
             for r in await db_new.get_reaction_roles_by_guild(session, guildid)
-        ]
+        )
+
+
+async def get_trigger_rules(guild_id: int) -> tuple[TriggerEntry, ...]:
+    async with db_new.get_session(guild_id) as session:
+        return tuple(
+            TriggerEntry(t.TriggerID, t.Pattern, t.Match, t.Reaction)
+            for t in await db_new.get_trigger_rules_by_guild(session, guild_id)
+        )
+
+
+async def add_trigger_rule(
+    guild_id: int, pattern: str, match: str, reaction: str
+) -> int:
+    return await db_new.write_guild(
+        guild_id, db_new.create_trigger_rule, guild_id, pattern, match, reaction
+    )
+
+
+async def remove_trigger_rule(guild_id: int, trigger_id: int) -> bool:
+    return await db_new.write_guild(
+        guild_id, db_new.delete_trigger_rule, guild_id, trigger_id
+    )
 
 
 async def set_starbits(user_id: int, starbits: int) -> None:
-    async with db_new.get_session() as session:
-        await db_new.update_user_config(session, user_id, Starbits=starbits)
+    await db_new.write(db_new.update_user_config, user_id, Starbits=starbits)
+    ranking.starbits.update(user_id, starbits)
 
 
-async def set_starbit_collection(user_id: int, timestamp: int) -> None:
+async def load_starbits_ranking() -> None:
+    """Fills :data:`ranking.starbits` with every user's balance."""
     async with db_new.get_session() as session:
-        await db_new.update_user_config(
-            session,
-            user_id,
-            StarbitsNext=datetime.fromtimestamp(timestamp, timezone.utc),
+        ranking.starbits.load(
+            [
+                (user_id, starbits)
+                async for user_id, starbits in db_new.stream_columns(
+                    session, db_new.UserConfig.UserID, db_new.UserConfig.Starbits
+                )
+            ]
         )
 
 
-async def add_starbits(user_id: int, starbits: int) -> None:
-    async with db_new.get_session() as session:
-        user_data = await db_new.get_user_config_or_default(session, user_id)
-        user_data.Starbits += starbits
-        session.add(user_data)
-        await session.commit()
+async def get_starbits_rank(user_id: int) -> tuple[int | None, int]:
+    """
+    Gets a user's position on the starbits leaderboard.
+
+    Returns:
+        tuple[int | None, int]: The user's rank, 1 being the richest, or None if
+        they have no balance yet, and the number of ranked users.
+    """
+    return ranking.starbits.rank(user_id), len(ranking.starbits)
+
+
+async def set_starbit_collection(user_id: int, timestamp: int) -> None:
+    await db_new.write(
+        db_new.update_user_config,
+        user_id,
+        StarbitsNext=datetime.fromtimestamp(timestamp, timezone.utc),
+    )
+
+
+async def add_starbits(user_id: int, starbits: int) -> int:
+    balance = await db_new.write(db_new.add_starbits, user_id, starbits)
+    ranking.starbits.update(user_id, balance)
+    return balance
+
+
+async def gamble_starbits(user_id: int, stake: int, payout: int) -> int | None:
+    """
+    Takes the stake from a user's balance and pays out the winnings in one go.
+
+    Args:
+        user_id (int): ID of the user.
+        stake (int): Amount of starbits the user bets.
+        payout (int): Amount of starbits the user gets back.
+
+    Returns:
+        int | None: The new balance, or None if the user can't cover the stake.
+    """
+    balance = await db_new.write(db_new.gamble_starbits, user_id, stake, payout)
+    if balance is not None:
+        ranking.starbits.update(user_id, balance)
+    return balance
+
+
+async def claim_starbits(user_id: int, amount: int, next_collect: int) -> int | None:
+    """
+    Adds the daily starbits and starts the next cooldown, unless the user is still on cooldown.
+
+    Args:
+        user_id (int): ID of the user.
+        amount (int): Amount of starbits to add.
+        next_collect (int): Timestamp of the next time the user can collect.
+
+    Returns:
+        int | None: The new balance, or None if the user is still on cooldown.
+    """
+    balance = await db_new.write(
+        db_new.claim_starbits,
+        user_id,
+        amount,
+        datetime.fromtimestamp(next_collect, timezone.utc),
+    )
+    if balance is not None:
+        ranking.starbits.update(user_id, balance)
+    return balance
 
 
 async def set_channel_name(user_id: int, chan_name: str) -> None:
-    async with db_new.get_session() as session:
-        await db_new.update_user_config(
-            session, user_id, TempVoiceChannelName=chan_name
-        )
+    await db_new.write(
+        db_new.update_user_config, user_id, TempVoiceChannelName=chan_name
+    )
@@ -1,29 +1,471 @@
+import asyncio
 import contextlib
+import heapq
+import os
+import time
+import zlib
 from datetime import datetime, timezone
-from typing import AsyncGenerator, List, Optional
-
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.orm import sessionmaker
-from sqlmodel import Field, SQLModel, select
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+)
+
+from dotenv import load_dotenv
+from sqlalchemy import Connection, Index, Row, delete, event, inspect, make_url, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql import Select
+from sqlmodel import Field, Session, SQLModel, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-DATABASE_URL = "sqlite+aiosqlite:///database.db"
+import cache
+import dbstats
+from logs import Log
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///database.db")
+# Number of read-only connections, each aiosqlite connection has its own thread
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+# A write batch is committed once it holds this many jobs...
+WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "64"))
+# ...or this many seconds after its first job arrived, whichever comes first.
+WRITE_BATCH_DELAY = float(os.getenv("DB_WRITE_BATCH_DELAY", "0.005"))
+# Number of files the guild-scoped tables are spread over, 0 keeps them in DATABASE_URL
+SHARDS = int(os.getenv("DB_SHARDS", "0"))
+
+# Applied to every new SQLite connection, in this order.
+# WAL lets readers run alongside the writer, NORMAL only fsyncs at checkpoints
+# (still durable across application crashes), and the busy timeout makes
+# writers wait for the lock instead of raising "database is locked".
+# INCREMENTAL auto vacuum lets the maintenance job hand free pages back to the
+# file system in small steps, it only applies to new (or fully vacuumed) files.
+SQLITE_PRAGMAS = {
+    "auto_vacuum": os.getenv("DB_AUTO_VACUUM", "INCREMENTAL"),
+    "journal_mode": os.getenv("DB_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT", "5000")),  # milliseconds
+    "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024))),  # bytes
+    "cache_size": int(os.getenv("DB_CACHE_SIZE", "-16000")),  # negative = KiB
+}
+
+# The journal and auto vacuum modes are persistent and set by the writer, readers only refuse writes.
+READ_PRAGMAS = {
+    **{
+        k: v
+        for k, v in SQLITE_PRAGMAS.items()
+        if k not in ("journal_mode", "auto_vacuum")
+    },
+    "query_only": "ON",
+}
+
+
+def create_engine(url: str, pragmas: Optional[dict] = None, **kwargs) -> AsyncEngine:
+    """Creates an async engine that applies ``pragmas`` on every new connection.
+
+    Args:
+        url: The SQLAlchemy database URL.
+        pragmas: Pragmas to apply, defaults to :data:`SQLITE_PRAGMAS`.
+        **kwargs: Passed on to :func:`create_async_engine`.
+
+    Returns:
+        The configured engine.
+    """
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+    new_engine = create_async_engine(url, future=True, **kwargs)
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f"PRAGMA {key}={value}")
+        cursor.close()
+
+    return new_engine
+
+
+def _use_immediate_transactions(write_engine: AsyncEngine) -> None:
+    # The sqlite3 driver starts transactions lazily and behind SQLAlchemy's back,
+    # which breaks SAVEPOINTs. Take over and grab the write lock up front instead
+    # of upgrading a read lock halfway through (which can't wait on busy_timeout).
+    @event.listens_for(write_engine.sync_engine, "connect")
+    def _disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(write_engine.sync_engine, "begin")
+    def _begin_immediate(conn):
+        # this is where a write waits for other processes holding the lock
+        start = time.perf_counter()
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        dbstats.record_lock_wait(time.perf_counter() - start)
+
+
+class WriteQueue:
+    """Single writer task that group-commits queued mutation jobs.
+
+    A job is a coroutine function taking the session as first argument, like
+    every mutation in this module. Jobs are run one after another on a shared
+    session, each inside its own SAVEPOINT so a failing job doesn't take the
+    rest of the batch with it, and the whole batch is committed at once.
+
+    Attributes:
+        database: The database the jobs are written to.
+        batch_size: Maximum number of jobs per commit.
+        batch_delay: Maximum time in seconds a batch waits for more jobs.
+    """
+
+    def __init__(
+        self,
+        database: "Database",
+        batch_size: int = WRITE_BATCH_SIZE,
+        batch_delay: float = WRITE_BATCH_DELAY,
+    ):
+        self.database = database
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # held while a batch commits, and by paused() to hold batches back
+        self._committing = asyncio.Lock()
+
+    def submit(
+        self, job: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> asyncio.Future:
+        """Queues ``job(session, *args, **kwargs)`` for the next batch.
+
+        Returns:
+            A future resolving to the job's return value once the batch has
+            been committed, or to its exception if the job or commit failed.
+        """
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+        future = loop.create_future()
+        self._queue.put_nowait((job, args, kwargs, future))
+        return future
+
+    @contextlib.asynccontextmanager
+    async def paused(self) -> AsyncGenerator[None, None]:
+        """|coro|
+        Waits for the running batch to be committed and holds back the next ones until the block exits.
+
+        Jobs can still be submitted meanwhile, they're committed afterwards
+        instead of failing, however long the block takes.
+        """
+        async with self._committing:
+            yield
+
+    async def close(self) -> None:
+        """|coro|
+        Waits for every queued job to be committed, then stops the writer task.
+        """
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self._queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(jobs) < self.batch_size:
+                try:
+                    if self._queue.empty():
+                        jobs.append(
+                            await asyncio.wait_for(
+                                self._queue.get(), deadline - loop.time()
+                            )
+                        )
+                    else:
+                        jobs.append(self._queue.get_nowait())
+                except asyncio.TimeoutError:
+                    break
+            try:
+                async with self._committing:
+                    await self._commit_batch(jobs)
+            finally:
+                for _ in jobs:
+                    self._queue.task_done()
+
+    async def _commit_batch(self, jobs: list) -> None:
+        done = []
+        try:
+            async with self.database.sessionmaker() as session:
+                session.info["batch"] = True
+                session.info["writes"] = True
+                for job, args, kwargs, future in jobs:
+                    if future.cancelled():
+                        continue
+                    try:
+                        async with session.begin_nested():
+                            result = await job(session, *args, **kwargs)
+                    except Exception as e:
+                        future.set_exception(e)
+                    else:
+                        done.append((future, result))
+                await session.commit()
+        except Exception as e:
+            for future, _ in done:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in done:
+            if not future.done():
+                future.set_result(result)
+
+
+class RoutingSession(Session):
+    """Session that sends plain SELECTs to the read pool and everything else to the writer.
+
+    Once a session has written (or flushed) it sticks to the writer, so it
+    always reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        database: Database = self.info["database"]
+        if (
+            self.info.get("writes")
+            or self._flushing
+            or (clause is not None and not isinstance(clause, Select))
+        ):
+            self.info["writes"] = True
+            return database.write_engine.sync_engine
+        return database.read_engine.sync_engine
+
+
+dbstats.instrument_sessions(RoutingSession)
+
+
+class Database:
+    """A SQLite database file with a read-only connection pool and a single writer connection.
+
+    Under WAL, reads on the pool never wait for the writer, while all writes
+    are serialized on the one writer connection instead of fighting over the
+    file lock.
+
+    Attributes:
+        url: The SQLAlchemy database URL.
+        name: Short name for logs and stats, e.g. ``"main"`` or ``"shard0"``.
+        write_engine: Engine holding the only connection that may write.
+        read_engine: Engine holding ``read_pool_size`` read-only connections.
+        sessionmaker: Factory for sessions routed between the two engines.
+        writer: Queue group-committing mutations on the writer connection.
+    """
+
+    def __init__(
+        self, url: str, read_pool_size: int = READ_POOL_SIZE, name: str = "main"
+    ):
+        self.url = url
+        self.name = name
+        self.write_engine = create_engine(
+            url, poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0
+        )
+        _use_immediate_transactions(self.write_engine)
+        dbstats.instrument(self.write_engine.sync_engine, f"{name} write")
+        self.read_engine = create_engine(
+            url,
+            READ_PRAGMAS,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=read_pool_size,
+            max_overflow=0,
+        )
+        dbstats.instrument(self.read_engine.sync_engine, f"{name} read")
+        # One factory for the whole process, building a sessionmaker is not free.
+        self.sessionmaker = async_sessionmaker(
+            class_=AsyncSession,
+            sync_session_class=RoutingSession,
+            expire_on_commit=False,
+            info={"database": self},
+        )
+        self.writer = WriteQueue(self)
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncGenerator[AsyncSession, None]:
+        """|coro|
+        Yields a session on this database that is rolled back when the block exits, see :func:`get_session`.
+        """
+        async with self.sessionmaker() as session:
+            session: AsyncSession
+            try:
+                yield session
+            finally:
+                await session.rollback()
+
+    async def dispose(self) -> None:
+        """|coro|
+        Commits all queued writes, then closes every pooled connection of both engines.
+        """
+        await self.writer.close()
+        await self.write_engine.dispose()
+        await self.read_engine.dispose()
+
+
+def shard_url(url: str, shard: int) -> str:
+    """Returns the URL of shard number ``shard`` of the database at ``url``.
+
+    Shards live next to the main file, ``database.db`` has ``database.shard0.db``,
+    ``database.shard1.db`` and so on.
+    """
+    parsed = make_url(url)
+    path = Path(parsed.database)
+    return parsed.set(
+        database=str(path.with_name(f"{path.stem}.shard{shard}{path.suffix}"))
+    ).render_as_string(hide_password=False)
+
+
+# User-scoped tables, and guild-scoped ones too unless sharding is on
+database = Database(DATABASE_URL)
+# With DB_SHARDS set, every guild's ServerConfig, AutoRole, ReactionRole and
+# TempChannel rows live in one of these, each with its own writer and lock
+shards = [
+    Database(shard_url(DATABASE_URL, shard), name=f"shard{shard}")
+    for shard in range(SHARDS)
+]
+engine = database.write_engine
+async_session = database.sessionmaker
+
+
+def shard_index(guild_id: int, shard_count: int) -> int:
+    # crc32 instead of hash(), which is the identity for ints and would pile
+    # up guilds created in the same millisecond range
+    return zlib.crc32(guild_id.to_bytes(8, "little")) % shard_count
+
+
+def database_for(guild_id: Optional[int] = None) -> Database:
+    """Returns the database holding ``guild_id``'s guild-scoped rows, or the main database without one."""
+    if guild_id is None or not shards:
+        return database
+    return shards[shard_index(guild_id, len(shards))]
+
+
+def guild_databases() -> List[Database]:
+    """Returns every database holding guild-scoped rows, for reads across all guilds."""
+    return shards or [database]
+
+
+def all_databases() -> List[Database]:
+    return [database, *shards]
+
+
+def group_by_database(guild_ids: Iterable[int]) -> dict[Database, List[int]]:
+    """Splits guild IDs by the database holding their rows."""
+    groups = {}
+    for guild_id in guild_ids:
+        groups.setdefault(database_for(guild_id), []).append(guild_id)
+    return groups
+
+
+def write(job: Callable[..., Awaitable[Any]], *args, **kwargs) -> asyncio.Future:
+    """Queues a mutation on the single writer, to be group-committed with others.
+
+    ``job`` is called as ``job(session, *args, **kwargs)``, so any mutation in
+    this module can be passed directly.
+    Example:
+
+    .. code-block:: python
+
+        await write(update_user_config, user_id, Starbits=10)
+
+    Returns:
+        A future that resolves to the job's return value once it is durable.
+    """
+    return database.writer.submit(job, *args, **kwargs)
 
-engine = create_async_engine(DATABASE_URL, future=True)
+
+def write_guild(
+    guild_id: int, job: Callable[..., Awaitable[Any]], *args, **kwargs
+) -> asyncio.Future:
+    """Like :func:`write`, but on the database holding ``guild_id``'s rows.
+
+    Use this for every mutation of ServerConfig, AutoRole, ReactionRole or TempChannel.
+    """
+    return database_for(guild_id).writer.submit(job, *args, **kwargs)
+
+
+# SQLite builds before 3.32 refuse statements with more bound parameters than this
+MAX_SQL_PARAMETERS = 999
+
+
+def _chunks(items: Iterable, size: int) -> Iterable[list]:
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+async def _delete_in(session: AsyncSession, column, ids: Iterable[int]) -> int:
+    # One DELETE ... WHERE column IN (...) per MAX_SQL_PARAMETERS ids
+    deleted = 0
+    for chunk in _chunks(ids, MAX_SQL_PARAMETERS):
+        result = await session.exec(delete(column.class_).where(column.in_(chunk)))
+        deleted += result.rowcount
+    return deleted
+
+
+async def _insert_many(
+    session: AsyncSession, model, rows: list[dict], skip_existing: bool = False
+) -> None:
+    # One multi-row INSERT per MAX_SQL_PARAMETERS bound values
+    if not rows:
+        return
+    per_statement = max(1, MAX_SQL_PARAMETERS // len(rows[0]))
+    for chunk in _chunks(rows, per_statement):
+        statement = insert(model).values(chunk)
+        if skip_existing:
+            statement = statement.on_conflict_do_nothing()
+        await session.exec(statement)
+
+
+async def _commit(session: AsyncSession) -> None:
+    # Jobs running in a write batch only flush, the batch commits them all at once.
+    if session.info.get("batch"):
+        await session.flush()
+    else:
+        await session.commit()
 
 
 async def init_db():
     """|coro|
-    Initialize the database by creating the tables.
+    Initialize the database by creating the tables and running pending migrations.
+
+    A fresh database gets the current schema straight from the SQLModel
+    metadata and is stamped with the latest version. An existing database
+    runs every migration in :data:`MIGRATIONS` newer than its
+    ``PRAGMA user_version``, all in one transaction.
 
-    This function will create the tables defined in the SQLModel metadata
-    if they do not already exist. If the tables do already exist, this
-    function will do nothing.
+    Every shard is a database of its own and is migrated the same way.
 
     This function is idempotent and can be safely called multiple times.
     """
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
+    for db in all_databases():
+        async with db.write_engine.begin() as conn:
+            await conn.run_sync(_migrate)
+
+
+def _migrate(conn: Connection) -> None:
+    version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+    if version == 0 and not inspect(conn).get_table_names():
+        SQLModel.metadata.create_all(conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        Log["database"].info(
+            f"Created {conn.engine.url.database} at schema version {len(MIGRATIONS)}"
+        )
+        return
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+        Log["database"].info(
+            f"Migrated {conn.engine.url.database} to schema version {number}"
+        )
 
 
 async def destroy_db():
@@ -34,12 +476,15 @@ async def destroy_db():
     It should be used with caution, as this will result in the loss of all data
     stored in the database. This function is idempotent and can be safely called multiple times.
     """
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.drop_all)
+    for db in all_databases():
+        async with db.write_engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.drop_all)
 
 
 @contextlib.asynccontextmanager
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
+async def get_session(
+    guild_id: Optional[int] = None,
+) -> AsyncGenerator[AsyncSession, None]:
     """|coro|
     Asynchronous generator that yields an :class:`AsyncSession` object.
 
@@ -53,14 +498,13 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
             # Do something with session
 
     The session will be properly closed when the context manager is exited.
+
+    Args:
+        guild_id: Needed to read or write guild-scoped tables (ServerConfig, AutoRole,
+            ReactionRole, TempChannel) when sharding is on, see :func:`database_for`.
     """
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-    async with async_session() as session:
-        session: AsyncSession
-        try:
-            yield session
-        finally:
-            await session.rollback()
+    async with database_for(guild_id).session() as session:
+        yield session
 
 
 class ServerConfig(SQLModel, table=True):
@@ -75,6 +519,9 @@ class ServerConfig(SQLModel, table=True):
 
 
 class UserConfig(SQLModel, table=True):
+    # Covers the leaderboard: walked backwards it yields (Starbits, UserID) richest first
+    __table_args__ = (Index("ix_userconfig_Starbits_UserID", "Starbits", "UserID"),)
+
     UserID: int = Field(default=None, primary_key=True)
     TempVoiceChannelName: Optional[str] = Field(default=None)
     Starbits: int = Field(default=0)
@@ -86,17 +533,23 @@ class TempChannel(SQLModel, table=True):
     # ID of the temporary voice channel
     ChannelID: int = Field(default=None, primary_key=True)
     # ID of the guild to which the temporary voice channel belongs (probably redundant)
-    GuildID: int
+    GuildID: int = Field(index=True)
 
 
 class ReactionRole(SQLModel, table=True):
+    # every reaction event looks up its message + emoji
+    __table_args__ = (Index("ix_reactionrole_MessageID_Emoji", "MessageID", "Emoji"),)
+
     ReactRoleID: int = Field(default=None, primary_key=True)
+    # ID of the guild the message is in
+    GuildID: Optional[int] = Field(default=None, index=True)
     # ID of the message to which the reaction is attached
     MessageID: int
-    # ID of the channel to which the message belongs
-    ChannelID: int
+    # ID of the channel to which the message belongs, None for reaction roles
+    # created before it was stored, see _migration_3_legacy_reaction_role_channels
+    ChannelID: Optional[int] = Field(default=None, index=True)
     # The ID of the role to assign when the reaction is clicked
-    RoleID: int
+    RoleID: int = Field(index=True)
     # The emoji to react with & which we want to listen for
     Emoji: str
 
@@ -104,11 +557,198 @@ class ReactionRole(SQLModel, table=True):
 class AutoRole(SQLModel, table=True):
     AutoRoleID: int = Field(default=None, primary_key=True)
     # ID of the guild to which the role belongs
-    GuildID: int
+    GuildID: int = Field(index=True)
     # The ID of the role to assign when a user joins
     RoleID: int
 
 
+class TriggerRule(SQLModel, table=True):
+    TriggerID: int = Field(default=None, primary_key=True)
+    # ID of the guild whose messages the rule applies to
+    GuildID: int = Field(index=True)
+    # Text to look for, compared case-insensitively
+    Pattern: str
+    # "contains" matches the pattern anywhere in a message, "exact" only the whole message
+    Match: str = Field(default="contains")
+    # The emoji to react with
+    Reaction: str
+
+
+def _migration_1_secondary_indexes(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS "ix_reactionrole_MessageID_Emoji" '
+        'ON reactionrole ("MessageID", "Emoji")'
+    )
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS "ix_reactionrole_ChannelID" '
+        'ON reactionrole ("ChannelID")'
+    )
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS "ix_reactionrole_RoleID" ON reactionrole ("RoleID")'
+    )
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS "ix_autorole_GuildID" ON autorole ("GuildID")'
+    )
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS "ix_tempchannel_GuildID" ON tempchannel ("GuildID")'
+    )
+
+
+def _migration_2_reaction_role_guild(conn: Connection) -> None:
+    conn.exec_driver_sql('ALTER TABLE reactionrole ADD COLUMN "GuildID" INTEGER')
+    # `rr add` used to pass the guild ID as the channel ID, so that's where it is.
+    # The guild ID stays behind in ChannelID, migration 3 clears it.
+    conn.exec_driver_sql('UPDATE reactionrole SET "GuildID" = "ChannelID"')
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS "ix_reactionrole_GuildID" ON reactionrole ("GuildID")'
+    )
+
+
+def _migration_3_legacy_reaction_role_channels(conn: Connection) -> None:
+    # Migration 2 left the guild ID in ChannelID of reaction roles from before
+    # channels were stored. That's no channel, and code going by channel (the
+    # reconciler, the prefetch) took them for deleted ones. SQLite can't drop
+    # NOT NULL from a column, so the table is rebuilt with ChannelID nullable
+    # and those rows get NULL, "channel unknown".
+    for index in ("MessageID_Emoji", "GuildID", "ChannelID", "RoleID"):
+        conn.exec_driver_sql(f'DROP INDEX IF EXISTS "ix_reactionrole_{index}"')
+    conn.exec_driver_sql("ALTER TABLE reactionrole RENAME TO reactionrole_old")
+    conn.exec_driver_sql(
+        "CREATE TABLE reactionrole ("
+        '"ReactRoleID" INTEGER NOT NULL, "GuildID" INTEGER, '
+        '"MessageID" INTEGER NOT NULL, "ChannelID" INTEGER, '
+        '"RoleID" INTEGER NOT NULL, "Emoji" VARCHAR NOT NULL, '
+        'PRIMARY KEY ("ReactRoleID"))'
+    )
+    legacy = conn.exec_driver_sql(
+        'SELECT COUNT(*) FROM reactionrole_old WHERE "ChannelID" = "GuildID"'
+    ).scalar()
+    conn.exec_driver_sql(
+        'INSERT INTO reactionrole ("ReactRoleID", "GuildID", "MessageID", '
+        '"ChannelID", "RoleID", "Emoji") '
+        'SELECT "ReactRoleID", "GuildID", "MessageID", '
+        'NULLIF("ChannelID", "GuildID"), "RoleID", "Emoji" FROM reactionrole_old'
+    )
+    conn.exec_driver_sql("DROP TABLE reactionrole_old")
+    conn.exec_driver_sql(
+        'CREATE INDEX "ix_reactionrole_MessageID_Emoji" '
+        'ON reactionrole ("MessageID", "Emoji")'
+    )
+    for column in ("GuildID", "ChannelID", "RoleID"):
+        conn.exec_driver_sql(
+            f'CREATE INDEX "ix_reactionrole_{column}" ON reactionrole ("{column}")'
+        )
+    Log["database"].info(f"Marked the channel of {legacy} reaction roles as unknown")
+
+
+def _migration_4_starbits_leaderboard(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS "ix_userconfig_Starbits_UserID" '
+        'ON userconfig ("Starbits", "UserID")'
+    )
+
+
+def _migration_5_compact_default_rows(conn: Connection) -> None:
+    # Reads used to store a default row for every ID they saw. Those rows hold
+    # nothing the defaults don't, so dropping them changes no behaviour.
+    servers = conn.exec_driver_sql(
+        'DELETE FROM serverconfig WHERE "WelcomeChannelID" IS NULL '
+        'AND "VoiceCreationChannelID" IS NULL AND "ReactionToggle" = 1'
+    ).rowcount
+    # a cooldown that's still running is not a default, keep those
+    users = conn.exec_driver_sql(
+        'DELETE FROM userconfig WHERE "TempVoiceChannelName" IS NULL '
+        'AND "Starbits" = 0 AND "StarbitsNext" <= datetime(\'now\')'
+    ).rowcount
+    Log["database"].info(
+        f"Removed {servers} default server configs and {users} default user configs"
+    )
+
+
+def _migration_6_trigger_rules(conn: Connection) -> None:
+    TriggerRule.__table__.create(conn, checkfirst=True)
+
+
+# Schema changes for existing databases, in order. Migration N brings a database
+# from user_version N-1 to N. Never edit or reorder released migrations, append
+# a new one and update the models to match.
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _migration_1_secondary_indexes,
+    _migration_2_reaction_role_guild,
+    _migration_3_legacy_reaction_role_channels,
+    _migration_4_starbits_leaderboard,
+    _migration_5_compact_default_rows,
+    _migration_6_trigger_rules,
+]
+
+# Tables holding one guild's rows, with the column naming the guild.
+# These are the ones spread over the shards.
+GUILD_TABLES = {
+    ServerConfig: "ServerID",
+    AutoRole: "GuildID",
+    ReactionRole: "GuildID",
+    TempChannel: "GuildID",
+    TriggerRule: "GuildID",
+}
+
+# Tables mirrored in a read-through cache, with the primary key the cache is keyed by
+CACHED_TABLES = {
+    ServerConfig: ("ServerID", cache.server_configs),
+    UserConfig: ("UserID", cache.user_configs),
+}
+
+
+def _invalidate_after_commit(session: AsyncSession, model, key: int) -> None:
+    # For Core statements, ORM flushes are picked up by _track_cached_rows
+    session.info.setdefault("invalidate", set()).add((model, key))
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _track_cached_rows(session: Session, flush_context) -> None:
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if type(instance) in CACHED_TABLES:
+            key_name, _ = CACHED_TABLES[type(instance)]
+            session.info.setdefault("invalidate", set()).add(
+                (type(instance), getattr(instance, key_name))
+            )
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _invalidate_caches(session: Session) -> None:
+    # Only after the commit, so nobody can load and cache the old row in between
+    for model, key in session.info.pop("invalidate", ()):
+        CACHED_TABLES[model][1].invalidate(key)
+
+
+async def stream_columns(
+    session: AsyncSession, *columns, batch_size: int = 1000
+) -> AsyncIterator[Row]:
+    """|coro|
+    Streams the given columns of every row of their table, ``batch_size`` rows at a time.
+
+    Memory use stays constant no matter how big the table is.
+    Example:
+
+    .. code-block:: python
+
+        async for guild_id, role_id in stream_columns(session, AutoRole.GuildID, AutoRole.RoleID):
+            ...
+
+    Args:
+        session: The database session to use.
+        *columns: The columns to select.
+        batch_size: How many rows to fetch from the cursor at once.
+
+    Returns:
+        An async iterator over the rows.
+    """
+    result = await session.stream(
+        select(*columns).execution_options(yield_per=batch_size)
+    )
+    async for row in result:
+        yield row
+
+
 async def get_server_config(
     session: AsyncSession, server_id: int
 ) -> Optional[ServerConfig]:
@@ -125,30 +765,51 @@ async def get_server_config(
     return server_config
 
 
+async def get_server_configs(
+    session: AsyncSession, server_ids: Iterable[int]
+) -> dict[int, ServerConfig]:
+    """|coro|
+    Retrieves the configurations of many servers, with one query per :data:`MAX_SQL_PARAMETERS` IDs.
+
+    Args:
+        server_ids: The IDs of the servers to retrieve the configurations for.
+
+    Returns:
+        A dict mapping server IDs to configurations. Servers without a configuration are left out.
+    """
+    configs = {}
+    for chunk in _chunks(set(server_ids), MAX_SQL_PARAMETERS):
+        for config in await session.exec(
+            select(ServerConfig).where(ServerConfig.ServerID.in_(chunk))
+        ):
+            configs[config.ServerID] = config
+    return configs
+
+
 async def get_server_config_or_default(
     session: AsyncSession, server_id: int
 ) -> ServerConfig:
     """|coro|
-    Retrieves a server's configuration from the database, creating a default configuration if none exists.
+    Retrieves a server's configuration from the database, or a default configuration if none exists.
+
+    The default is not added to the session, so reading never writes. It is
+    only stored once a change to it is committed, see :func:`update_server_config`.
 
     Args:
-        server_id: The ID of the server to retrieve or create the configuration for.
+        server_id: The ID of the server to retrieve the configuration for.
 
     Returns:
-        The server's configuration, creating and returning a default configuration if the server has none.
+        The server's configuration, or an unsaved default configuration if the server has none.
     """
     server_config = await session.get(ServerConfig, server_id)
     if server_config is None:
         server_config = ServerConfig(ServerID=server_id)
-        session.add(server_config)
-        await session.commit()
-        await session.refresh(server_config)
     return server_config
 
 
 async def update_server_config(session: AsyncSession, server_id: int, **kwargs) -> None:
     """|coro|
-    Updates a server's configuration in the database.
+    Updates a server's configuration in the database, storing it first if it only had defaults.
 
     Args:
         server_id: The ID of the server to update the configuration for.
@@ -161,7 +822,7 @@ async def update_server_config(session: AsyncSession, server_id: int, **kwargs)
     for key, value in kwargs.items():
         setattr(server_config, key, value)
     session.add(server_config)
-    await session.commit()
+    await _commit(session)
 
 
 async def get_user_config(session: AsyncSession, user_id: int) -> Optional[UserConfig]:
@@ -178,22 +839,43 @@ async def get_user_config(session: AsyncSession, user_id: int) -> Optional[UserC
     return user_config
 
 
+async def get_user_configs(
+    session: AsyncSession, user_ids: Iterable[int]
+) -> dict[int, UserConfig]:
+    """|coro|
+    Retrieves the configurations of many users, with one query per :data:`MAX_SQL_PARAMETERS` IDs.
+
+    Args:
+        user_ids: The IDs of the users to retrieve the configurations for.
+
+    Returns:
+        A dict mapping user IDs to configurations. Users without a configuration are left out.
+    """
+    configs = {}
+    for chunk in _chunks(set(user_ids), MAX_SQL_PARAMETERS):
+        for config in await session.exec(
+            select(UserConfig).where(UserConfig.UserID.in_(chunk))
+        ):
+            configs[config.UserID] = config
+    return configs
+
+
 async def get_user_config_or_default(session: AsyncSession, user_id: int) -> UserConfig:
     """|coro|
-    Retrieves a user's configuration from the database, creating a default configuration if none exists.
+    Retrieves a user's configuration from the database, or a default configuration if none exists.
+
+    The default is not added to the session, so reading never writes. It is
+    only stored once a change to it is committed, see :func:`update_user_config`.
 
     Args:
-        user_id: The ID of the user to retrieve or create the configuration for.
+        user_id: The ID of the user to retrieve the configuration for.
 
     Returns:
-        The user's configuration, creating and returning a default configuration if the user has none.
+        The user's configuration, or an unsaved default configuration if the user has none.
     """
     user_config = await get_user_config(session, user_id)
     if user_config is None:
         user_config = UserConfig(UserID=user_id)
-        session.add(user_config)
-        await session.commit()
-        await session.refresh(user_config)
     return user_config
 
 
@@ -207,10 +889,46 @@ async def get_all_user_ids(session: AsyncSession) -> List[int]:
     return (await session.exec(select(UserConfig.UserID))).all()
 
 
+async def get_starbits_leaderboard(
+    session: AsyncSession, limit: int = 10, user_ids: Optional[Iterable[int]] = None
+) -> List[tuple[int, int]]:
+    """|coro|
+    Retrieves the users with the most starbits, richest first.
+
+    Without ``user_ids`` this only reads the first ``limit`` entries of the
+    ``(Starbits, UserID)`` index. With them, each chunk of IDs is ranked in
+    SQL and only the top ``limit`` of every chunk are merged in Python.
+
+    Args:
+        limit: The maximum number of users to return.
+        user_ids: Only rank these users, e.g. the members of a guild.
+
+    Returns:
+        A list of ``(user_id, starbits)`` tuples. Users without a row are left out.
+    """
+    query = (
+        select(UserConfig.UserID, UserConfig.Starbits)
+        .order_by(UserConfig.Starbits.desc(), UserConfig.UserID.desc())
+        .limit(limit)
+    )
+    if user_ids is None:
+        return [tuple(row) for row in (await session.exec(query)).all()]
+    top = []
+    # one parameter of every chunk is taken by the LIMIT
+    for chunk in _chunks(user_ids, MAX_SQL_PARAMETERS - 1):
+        top.extend(
+            (await session.exec(query.where(UserConfig.UserID.in_(chunk)))).all()
+        )
+    return [
+        tuple(row)
+        for row in heapq.nlargest(limit, top, key=lambda row: (row[1], row[0]))
+    ]
+
+
 async def update_user_config(session: AsyncSession, user_id: int, **kwargs) -> None:
     """
     |coro|
-    Updates a user's configuration in the database.
+    Updates a user's configuration in the database, storing it first if it only had defaults.
 
     Args:
         user_id: The ID of the user whose configuration is to be updated.
@@ -223,7 +941,112 @@ async def update_user_config(session: AsyncSession, user_id: int, **kwargs) -> N
     for key, value in kwargs.items():
         setattr(user_config, key, value)
     session.add(user_config)
-    await session.commit()
+    await _commit(session)
+
+
+async def add_starbits(session: AsyncSession, user_id: int, amount: int) -> int:
+    """|coro|
+    Atomically adds starbits to a user's balance, creating the user if needed.
+
+    This is a single ``INSERT ... ON CONFLICT DO UPDATE ... RETURNING`` statement,
+    so concurrent calls never lose each other's updates.
+
+    Args:
+        user_id: The ID of the user whose balance is to be changed.
+        amount: The amount of starbits to add, may be negative.
+
+    Returns:
+        The user's new balance.
+    """
+    statement = (
+        insert(UserConfig)
+        .values(
+            UserID=user_id, Starbits=amount, StarbitsNext=datetime.now(timezone.utc)
+        )
+        .on_conflict_do_update(
+            index_elements=[UserConfig.UserID],
+            set_={"Starbits": UserConfig.Starbits + amount},
+        )
+        .returning(UserConfig)
+    )
+    user_config = (
+        await session.exec(statement, execution_options={"populate_existing": True})
+    ).scalar_one()
+    _invalidate_after_commit(session, UserConfig, user_id)
+    await _commit(session)
+    return user_config.Starbits
+
+
+async def gamble_starbits(
+    session: AsyncSession, user_id: int, stake: int, payout: int
+) -> Optional[int]:
+    """|coro|
+    Atomically settles a gamble, checking the balance in the same statement.
+
+    Args:
+        user_id: The ID of the gambling user.
+        stake: The amount of starbits the user needs to have and bets.
+        payout: The amount of starbits paid back to the user, may be negative.
+
+    Returns:
+        The user's new balance, or None if the user can't cover the stake.
+        Users without a balance yet have 0.
+    """
+    statement = (
+        update(UserConfig)
+        .where(UserConfig.UserID == user_id, UserConfig.Starbits >= stake)
+        .values(Starbits=UserConfig.Starbits - stake + payout)
+        .returning(UserConfig.Starbits)
+    )
+    balance = (await session.exec(statement)).scalar_one_or_none()
+    if balance is None and stake <= 0:
+        # a user without a row has the default balance of 0, which covers it
+        exists = (
+            await session.exec(
+                select(UserConfig.UserID).where(UserConfig.UserID == user_id)
+            )
+        ).first()
+        if exists is None:
+            return await add_starbits(session, user_id, payout - stake)
+    _invalidate_after_commit(session, UserConfig, user_id)
+    await _commit(session)
+    return balance
+
+
+async def claim_starbits(
+    session: AsyncSession, user_id: int, amount: int, next_claim: datetime
+) -> Optional[int]:
+    """|coro|
+    Atomically claims starbits if the user's cooldown has passed, creating the user if needed.
+
+    The cooldown check, the balance update and moving the cooldown to
+    ``next_claim`` all happen in the same statement.
+
+    Args:
+        user_id: The ID of the claiming user.
+        amount: The amount of starbits to add.
+        next_claim: When the user may claim again.
+
+    Returns:
+        The user's new balance, or None if the user is still on cooldown.
+    """
+    now = datetime.now(timezone.utc)
+    statement = (
+        insert(UserConfig)
+        .values(UserID=user_id, Starbits=amount, StarbitsNext=next_claim)
+        .on_conflict_do_update(
+            index_elements=[UserConfig.UserID],
+            set_={"Starbits": UserConfig.Starbits + amount, "StarbitsNext": next_claim},
+            where=UserConfig.StarbitsNext <= now,
+        )
+        .returning(UserConfig)
+    )
+    user_config = (
+        await session.exec(statement, execution_options={"populate_existing": True})
+    ).scalar_one_or_none()
+    _invalidate_after_commit(session, UserConfig, user_id)
+    await _commit(session)
+    return None if user_config is None else user_config.Starbits
 
 
 async def is_temp_channel(session: AsyncSession, channel_id: int) -> bool:
@@ -255,7 +1078,7 @@ async def create_temp_channel(
     """
     temp_channel = TempChannel(ChannelID=channel_id, GuildID=guild_id)
     session.add(temp_channel)
-    await session.commit()
+    await _commit(session)
 
 
 async def delete_temp_channel(session: AsyncSession, channel_id: int) -> None:
@@ -271,7 +1094,7 @@ async def delete_temp_channel(session: AsyncSession, channel_id: int) -> None:
     temp_channel = await session.get(TempChannel, channel_id)
     if temp_channel is not None:
         await session.delete(temp_channel)
-        await session.commit()
+        await _commit(session)
 
 
 async def get_active_temp_channels(
@@ -304,19 +1127,37 @@ async def get_reaction_roles(session: AsyncSession) -> List[ReactionRole]:
     return (await session.exec(select(ReactionRole))).all()
 
 
-async def get_reaction_roles_by_channel(
-    session: AsyncSession, channel_id: int
+async def get_reaction_roles_by_guild(
+    session: AsyncSession, guild_id: int
 ) -> List[ReactionRole]:
     """|coro|
     Retrieves all reaction roles in a guild.
 
     Args:
         session: The database session to use.
-        channel_id: The ID of the guild to retrieve the reaction roles from.
+        guild_id: The ID of the guild to retrieve the reaction roles from.
 
     Returns:
         A list of all reaction roles in the guild.
     """
+    return (
+        await session.exec(select(ReactionRole).where(ReactionRole.GuildID == guild_id))
+    ).all()
+
+
+async def get_reaction_roles_by_channel(
+    session: AsyncSession, channel_id: int
+) -> List[ReactionRole]:
+    """|coro|
+    Retrieves all reaction roles in a channel.
+
+    Args:
+        session: The database session to use.
+        channel_id: The ID of the channel to retrieve the reaction roles from.
+
+    Returns:
+        A list of all reaction roles in the channel.
+    """
     return (
         await session.exec(
             select(ReactionRole).where(ReactionRole.ChannelID == channel_id)
@@ -387,13 +1228,19 @@ async def get_reaction_role_by_emoji_and_message(
 
 
 async def create_reaction_role(
-    session: AsyncSession, channel_id: int, message_id: int, role_id: int, emoji: str
+    session: AsyncSession,
+    guild_id: int,
+    channel_id: int,
+    message_id: int,
+    role_id: int,
+    emoji: str,
 ) -> None:
     """|coro|
     Creates a new reaction role in the database.
 
     Args:
         session: The database session to use.
+        guild_id: The ID of the guild that the reaction role is associated with.
         channel_id: The ID of the channel that the reaction role is associated with.
         message_id: The ID of the message that the reaction role is associated with.
         role_id: The ID of the role that the reaction role grants.
@@ -403,10 +1250,14 @@ async def create_reaction_role(
         None
     """
     reaction_role = ReactionRole(
-        ChannelID=channel_id, MessageID=message_id, RoleID=role_id, Emoji=emoji
+        GuildID=guild_id,
+        ChannelID=channel_id,
+        MessageID=message_id,
+        RoleID=role_id,
+        Emoji=emoji,
     )
     session.add(reaction_role)
-    await session.commit()
+    await _commit(session)
 
 
 async def delete_reaction_role(session: AsyncSession, reaction_role_id: int) -> None:
@@ -423,7 +1274,77 @@ async def delete_reaction_role(session: AsyncSession, reaction_role_id: int) ->
     reaction_role = await session.get(ReactionRole, reaction_role_id)
     if reaction_role is not None:
         await session.delete(reaction_role)
-        await session.commit()
+        await _commit(session)
+
+
+async def create_reaction_roles(session: AsyncSession, rows: list[dict]) -> None:
+    """|coro|
+    Creates many reaction roles with multi-row INSERTs in one transaction.
+
+    Args:
+        session: The database session to use.
+        rows: One dict per reaction role with ``GuildID``, ``ChannelID``,
+            ``MessageID``, ``RoleID`` and ``Emoji`` keys.
+
+    Returns:
+        None
+    """
+    await _insert_many(session, ReactionRole, rows)
+    await _commit(session)
+
+
+async def delete_reaction_roles_by_messages(
+    session: AsyncSession, message_ids: Iterable[int]
+) -> int:
+    """|coro|
+    Deletes all reaction roles associated with any of the given messages.
+
+    Args:
+        session: The database session to use.
+        message_ids: The IDs of the messages to delete the reaction roles from.
+
+    Returns:
+        The number of deleted reaction roles.
+    """
+    deleted = await _delete_in(session, ReactionRole.MessageID, message_ids)
+    await _commit(session)
+    return deleted
+
+
+async def delete_reaction_roles_by_channels(
+    session: AsyncSession, channel_ids: Iterable[int]
+) -> int:
+    """|coro|
+    Deletes all reaction roles in any of the given channels.
+
+    Args:
+        session: The database session to use.
+        channel_ids: The IDs of the channels to delete the reaction roles from.
+
+    Returns:
+        The number of deleted reaction roles.
+    """
+    deleted = await _delete_in(session, ReactionRole.ChannelID, channel_ids)
+    await _commit(session)
+    return deleted
+
+
+async def delete_reaction_roles_by_roles(
+    session: AsyncSession, role_ids: Iterable[int]
+) -> int:
+    """|coro|
+    Deletes all reaction roles granting any of the given roles.
+
+    Args:
+        session: The database session to use.
+        role_ids: The IDs of the roles to delete the reaction roles of.
+
+    Returns:
+        The number of deleted reaction roles.
+    """
+    deleted = await _delete_in(session, ReactionRole.RoleID, role_ids)
+    await _commit(session)
+    return deleted
 
 
 async def delete_reaction_roles_by_message(
@@ -439,10 +1360,7 @@ async def delete_reaction_roles_by_message(
     Returns:
         None
     """
-    reaction_roles = await get_reaction_roles_by_message(session, message_id)
-    for reaction_role in reaction_roles:
-        await session.delete(reaction_role)
-    await session.commit()
+    await delete_reaction_roles_by_messages(session, [message_id])
 
 
 async def delete_reaction_roles_by_role(session: AsyncSession, role_id: int) -> None:
@@ -456,10 +1374,7 @@ async def delete_reaction_roles_by_role(session: AsyncSession, role_id: int) ->
     Returns:
         None
     """
-    reaction_roles = await get_reaction_roles_by_role(session, role_id)
-    for reaction_role in reaction_roles:
-        await session.delete(reaction_role)
-    await session.commit()
+    await delete_reaction_roles_by_roles(session, [role_id])
 
 
 async def update_reaction_role(
@@ -481,7 +1396,7 @@ async def update_reaction_role(
     for key, value in kwargs.items():
         setattr(reaction_role, key, value)
     session.add(reaction_role)
-    await session.commit()
+    await _commit(session)
 
 
 async def get_auto_roles_by_guild(
@@ -514,9 +1429,26 @@ async def create_auto_role(session: AsyncSession, guild_id: int, role_id: int) -
     Returns:
         None
     """
-    auto_role = AutoRole(GuildID=guild_id, RoleID=role_id)
-    session.add(auto_role)
-    await session.commit()
+    await create_auto_roles(session, guild_id, [role_id])
+
+
+async def create_auto_roles(
+    session: AsyncSession, guild_id: int, role_ids: Iterable[int]
+) -> None:
+    """|coro|
+    Creates many auto roles for a guild with multi-row INSERTs in one transaction.
+
+    Args:
+        session: The database session to use.
+        guild_id: The ID of the guild that the auto roles are associated with.
+        role_ids: The IDs of the roles that the auto roles grant.
+
+    Returns:
+        None
+    """
+    rows = [{"GuildID": guild_id, "RoleID": role_id} for role_id in role_ids]
+    await _insert_many(session, AutoRole, rows)
+    await _commit(session)
 
 
 async def delete_auto_role(session: AsyncSession, auto_role_id: int) -> None:
@@ -533,7 +1465,34 @@ async def delete_auto_role(session: AsyncSession, auto_role_id: int) -> None:
     auto_role = await session.get(AutoRole, auto_role_id)
     if auto_role is not None:
         await session.delete(auto_role)
-        await session.commit()
+        await _commit(session)
+
+
+async def delete_auto_roles(
+    session: AsyncSession, guild_id: int, role_ids: Optional[Iterable[int]] = None
+) -> int:
+    """|coro|
+    Deletes a guild's auto roles with set-based DELETEs in one transaction.
+
+    Args:
+        session: The database session to use.
+        guild_id: The ID of the guild to delete the auto roles from.
+        role_ids: Only delete the auto roles granting these roles. ``None``
+            deletes all of the guild's auto roles.
+
+    Returns:
+        The number of deleted auto roles.
+    """
+    statement = delete(AutoRole).where(AutoRole.GuildID == guild_id)
+    if role_ids is None:
+        deleted = (await session.exec(statement)).rowcount
+    else:
+        deleted = 0
+        for chunk in _chunks(role_ids, MAX_SQL_PARAMETERS - 1):
+            result = await session.exec(statement.where(AutoRole.RoleID.in_(chunk)))
+            deleted += result.rowcount
+    await _commit(session)
+    return deleted
 
 
 async def delete_auto_roles_by_guild(session: AsyncSession, guild_id: int) -> None:
@@ -547,10 +1506,237 @@ async def delete_auto_roles_by_guild(session: AsyncSession, guild_id: int) -> No
     Returns:
         None
     """
-    auto_roles = await get_auto_roles_by_guild(session, guild_id)
-    for auto_role in auto_roles:
-        await session.delete(auto_role)
-    await session.commit()
+    await delete_auto_roles(session, guild_id)
+
+
+async def get_trigger_rules_by_guild(
+    session: AsyncSession, guild_id: int
+) -> List[TriggerRule]:
+    """|coro|
+    Retrieves all trigger rules of a guild, oldest first.
+
+    Args:
+        session: The database session to use.
+        guild_id: The ID of the guild to retrieve the trigger rules of.
+
+    Returns:
+        A list of all trigger rules of the guild.
+    """
+    return (
+        await session.exec(
+            select(TriggerRule)
+            .where(TriggerRule.GuildID == guild_id)
+            .order_by(TriggerRule.TriggerID)
+        )
+    ).all()
+
+
+async def create_trigger_rule(
+    session: AsyncSession, guild_id: int, pattern: str, match: str, reaction: str
+) -> int:
+    """|coro|
+    Creates a new trigger rule in the database.
+
+    Args:
+        session: The database session to use.
+        guild_id: The ID of the guild the rule applies to.
+        pattern: The text to look for.
+        match: ``"contains"`` or ``"exact"``.
+        reaction: The emoji to react with.
+
+    Returns:
+        The ID of the new trigger rule.
+    """
+    trigger_rule = TriggerRule(
+        GuildID=guild_id, Pattern=pattern, Match=match, Reaction=reaction
+    )
+    session.add(trigger_rule)
+    await _commit(session)
+    return trigger_rule.TriggerID
+
+
+async def delete_trigger_rule(
+    session: AsyncSession, guild_id: int, trigger_id: int
+) -> bool:
+    """|coro|
+    Deletes one of a guild's trigger rules.
+
+    Args:
+        session: The database session to use.
+        guild_id: The ID of the guild the rule belongs to.
+        trigger_id: The ID of the trigger rule to delete.
+
+    Returns:
+        Whether the guild had such a rule.
+    """
+    result = await session.exec(
+        delete(TriggerRule).where(
+            TriggerRule.GuildID == guild_id, TriggerRule.TriggerID == trigger_id
+        )
+    )
+    await _commit(session)
+    return result.rowcount > 0
+
+
+async def get_referenced_channels(
+    session: AsyncSession, guild_id: int, channel_ids: Iterable[int]
+) -> set[int]:
+    """|coro|
+    Finds which of the given channels any of a guild's stored rows refer to.
+
+    Args:
+        session: The database session to use.
+        guild_id: The ID of the guild the channels belong to.
+        channel_ids: The IDs of the channels to look for.
+
+    Returns:
+        The IDs of the channels that are referenced.
+    """
+    # legacy reaction roles imported from old dumps can hold the guild ID as
+    # their channel, it must never look like a referenced channel
+    channel_ids = set(channel_ids) - {guild_id}
+    referenced = set()
+    server_config = await session.get(ServerConfig, guild_id)
+    if server_config is not None:
+        referenced |= channel_ids & {
+            server_config.WelcomeChannelID,
+            server_config.VoiceCreationChannelID,
+        }
+    for column in (ReactionRole.ChannelID, TempChannel.ChannelID):
+        for chunk in _chunks(channel_ids - referenced, MAX_SQL_PARAMETERS):
+            referenced.update(
+                await session.exec(select(column).where(column.in_(chunk)).distinct())
+            )
+    return referenced
+
+
+async def get_referenced_roles(
+    session: AsyncSession, role_ids: Iterable[int]
+) -> set[int]:
+    """|coro|
+    Finds which of the given roles are auto roles or reaction roles.
+
+    Args:
+        session: The database session to use.
+        role_ids: The IDs of the roles to look for.
+
+    Returns:
+        The IDs of the roles that are referenced.
+    """
+    role_ids = set(role_ids)
+    referenced = set()
+    for column in (AutoRole.RoleID, ReactionRole.RoleID):
+        for chunk in _chunks(role_ids - referenced, MAX_SQL_PARAMETERS):
+            referenced.update(
+                await session.exec(select(column).where(column.in_(chunk)).distinct())
+            )
+    return referenced
+
+
+async def get_referenced_messages(
+    session: AsyncSession, message_ids: Iterable[int]
+) -> set[int]:
+    """|coro|
+    Finds which of the given messages have reaction roles.
+
+    Args:
+        session: The database session to use.
+        message_ids: The IDs of the messages to look for.
+
+    Returns:
+        The IDs of the messages that have reaction roles.
+    """
+    referenced = set()
+    for chunk in _chunks(set(message_ids), MAX_SQL_PARAMETERS):
+        referenced.update(
+            await session.exec(
+                select(ReactionRole.MessageID)
+                .where(ReactionRole.MessageID.in_(chunk))
+                .distinct()
+            )
+        )
+    return referenced
+
+
+async def purge_guild(session: AsyncSession, guild_id: int) -> int:
+    """|coro|
+    Deletes everything stored about a guild, one DELETE per table.
+
+    Args:
+        session: The database session to use.
+        guild_id: The ID of the guild to forget.
+
+    Returns:
+        The number of deleted rows.
+    """
+    deleted = 0
+    for model, column in GUILD_TABLES.items():
+        result = await session.exec(
+            delete(model).where(getattr(model, column) == guild_id)
+        )
+        deleted += result.rowcount
+    _invalidate_after_commit(session, ServerConfig, guild_id)
+    await _commit(session)
+    return deleted
+
+
+async def purge_roles(
+    session: AsyncSession, guild_id: int, role_ids: Iterable[int]
+) -> int:
+    """|coro|
+    Deletes the auto roles and reaction roles granting any of the given (deleted) roles.
+
+    Args:
+        session: The database session to use.
+        guild_id: The ID of the guild the roles belonged to.
+        role_ids: The IDs of the roles.
+
+    Returns:
+        The number of deleted rows.
+    """
+    role_ids = set(role_ids)
+    deleted = await _delete_in(session, ReactionRole.RoleID, role_ids)
+    for chunk in _chunks(role_ids, MAX_SQL_PARAMETERS - 1):
+        result = await session.exec(
+            delete(AutoRole).where(
+                AutoRole.GuildID == guild_id, AutoRole.RoleID.in_(chunk)
+            )
+        )
+        deleted += result.rowcount
+    await _commit(session)
+    return deleted
+
+
+async def purge_channels(
+    session: AsyncSession, guild_id: int, channel_ids: Iterable[int]
+) -> int:
+    """|coro|
+    Deletes the reaction roles and temp channels in any of the given (deleted) channels,
+    and unsets them in the guild's config.
+
+    Args:
+        session: The database session to use.
+        guild_id: The ID of the guild the channels belonged to.
+        channel_ids: The IDs of the channels.
+
+    Returns:
+        The number of deleted or changed rows.
+    """
+    # see get_referenced_channels, the guild ID is never a channel to purge
+    channel_ids = set(channel_ids) - {guild_id}
+    deleted = await _delete_in(session, ReactionRole.ChannelID, channel_ids)
+    deleted += await _delete_in(session, TempChannel.ChannelID, channel_ids)
+    for column in (ServerConfig.WelcomeChannelID, ServerConfig.VoiceCreationChannelID):
+        for chunk in _chunks(channel_ids, MAX_SQL_PARAMETERS - 1):
+            result = await session.exec(
+                update(ServerConfig)
+                .where(ServerConfig.ServerID == guild_id, column.in_(chunk))
+                .values({column.key: None})
+            )
+            deleted += result.rowcount
+    _invalidate_after_commit(session, ServerConfig, guild_id)
+    await _commit(session)
+    return deleted
 
 
 if __name__ == "__main__":
@@ -0,0 +1,204 @@
+import math
+import os
+import re
+import time
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from logs import Log
+
+load_dotenv()
+# Statements taking longer than this many milliseconds are logged
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "100"))
+# Statements beyond this many distinct templates are counted under OTHER
+MAX_TEMPLATES = int(os.getenv("DB_STATS_MAX_TEMPLATES", "500"))
+
+OTHER = "<other>"
+
+# "IN (?, ?, ?)" and multi-row "VALUES (?, ?), (?, ?)" differ in length only
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_VALUES_LIST = re.compile(r"(\(\?\.\.\.\)|\(\?\))(?:\s*,\s*\1)+")
+
+
+class LatencyHistogram:
+    """Durations in fixed, logarithmically spaced buckets, from 1µs to about 2 minutes.
+
+    Every bucket is ~19% wider than the one before, so percentiles are
+    accurate to that much while the memory use stays constant.
+    """
+
+    MIN = 1e-6
+    GROWTH = 2**0.25
+    BUCKETS = 108
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        if seconds <= self.MIN:
+            bucket = 0
+        else:
+            bucket = min(
+                self.BUCKETS - 1, math.ceil(math.log(seconds / self.MIN, self.GROWTH))
+            )
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """Returns the upper bound of the bucket holding the ``p``-th percentile, in seconds."""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max, self.MIN * self.GROWTH**bucket)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "p50_ms": self.percentile(50) * 1000,
+            "p95_ms": self.percentile(95) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class DatabaseStats:
+    """Timings of everything sent to the database.
+
+    Attributes:
+        statements: Latency per statement template.
+        sessions: How long sessions held a connection, from their first statement to commit or rollback.
+        lock_waits: How long writes waited for SQLite's write lock.
+        slow_queries: Number of statements over :data:`SLOW_QUERY_MS`.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.statements: dict[str, LatencyHistogram] = {}
+        self.sessions = LatencyHistogram()
+        self.lock_waits = LatencyHistogram()
+        self.slow_queries = 0
+        self.since = time.time()
+
+    def statement(self, template: str) -> LatencyHistogram:
+        histogram = self.statements.get(template)
+        if histogram is None:
+            if len(self.statements) >= MAX_TEMPLATES:
+                template = OTHER
+            histogram = self.statements.setdefault(template, LatencyHistogram())
+        return histogram
+
+    def top(self, n: int = 10) -> list[tuple[str, dict]]:
+        """Returns the ``n`` templates the database spent the most time on, with their summaries."""
+        return [
+            (template, histogram.summary())
+            for template, histogram in sorted(
+                self.statements.items(), key=lambda item: item[1].total, reverse=True
+            )[:n]
+        ]
+
+
+stats = DatabaseStats()
+
+
+def template(statement: str) -> str:
+    """Collapses placeholder lists, so statements only differing in their number of IDs share a template."""
+    statement = _PLACEHOLDER_LIST.sub("?...", " ".join(statement.split()))
+    return _VALUES_LIST.sub(r"\1...", statement)
+
+
+def parameter_shape(parameters: Any, executemany: bool) -> Any:
+    """Describes bound parameters by type only, so no user data ends up in the log."""
+    if executemany:
+        rows = list(parameters)
+        return {
+            "rows": len(rows),
+            "row": parameter_shape(rows[0], False) if rows else None,
+        }
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        # runs of the same type are counted, an IN list would repeat it hundreds of times
+        shape = []
+        for value in parameters:
+            name = type(value).__name__
+            if shape and shape[-1][0] == name:
+                shape[-1][1] += 1
+            else:
+                shape.append([name, 1])
+        return [name if count == 1 else f"{name}*{count}" for name, count in shape]
+    return type(parameters).__name__
+
+
+def instrument(engine: Engine, name: str) -> None:
+    """Records the latency of every statement ``engine`` executes in :data:`stats`.
+
+    Args:
+        engine: The (sync) engine to instrument.
+        name: Shown in slow query logs, e.g. ``"read"`` or ``"write"``.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        sql = template(statement)
+        stats.statement(sql).observe(elapsed)
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            stats.slow_queries += 1
+            Log["database"].warning(
+                f"Slow query on {name} engine took {elapsed * 1000:.1f} ms",
+                extra={
+                    "engine": name,
+                    "statement": sql,
+                    "duration_ms": round(elapsed * 1000, 3),
+                    "parameters": parameter_shape(parameters, executemany),
+                },
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(exception_context):
+        # after_cursor_execute doesn't run for failed statements
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_start"):
+            connection.info["query_start"].pop()
+
+
+def record_lock_wait(seconds: float) -> None:
+    stats.lock_waits.observe(seconds)
+
+
+def instrument_sessions(session_class: type[Session]) -> None:
+    """Records how long sessions of ``session_class`` hold on to their connections."""
+
+    @event.listens_for(session_class, "after_begin")
+    def _connected(session, transaction, connection):
+        session.info.setdefault("connected_at", time.perf_counter())
+
+    @event.listens_for(session_class, "after_transaction_end")
+    def _released(session, transaction):
+        if transaction.parent is None:
+            connected_at: Optional[float] = session.info.pop("connected_at", None)
+            if connected_at is not None:
+                stats.sessions.observe(time.perf_counter() - connected_at)
@@ -57,6 +57,8 @@ logs = [
     "fun",
     "welcome",
     "reactroles",
+    "database",
+    "messages",
 ]
 
 
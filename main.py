@@ -13,6 +13,7 @@ import conf
 import db_new
 import func
 import logs
+import pipeline
 from logs import Log
 
 # environment stuff
@@ -35,10 +36,25 @@ colorama.deinit()  # allow colors for command outputs like in !gitpull
 
 
 @bot.event
-async def on_ready():
-    Log["bootstrap"].info(f"Successfully logged in as {bot.user}")
+async def setup_hook():
+    # runs once, before the bot connects to the gateway
+    await db_new.init_db()
+    Log["bootstrap"].info("Database is up to date")
+    pipeline.messages.register(
+        "commands",
+        lambda features: bot.process_commands(features.message),
+        lambda features: features.message.content.startswith(PREFIX),
+    )
     await load_extensions()
     Log["bootstrap"].info("Loaded extensions, check errors above (if any)")
+    await warm_up_cogs()
+    await conf.load_starbits_ranking()
+    Log["bootstrap"].info("Loaded starbits ranking")
+
+
+@bot.event
+async def on_ready():
+    Log["bootstrap"].info(f"Successfully logged in as {bot.user}")
     if (
         not update_presence.is_running()
     ):  # sometimes the bot restarts and runs the on_ready function.
@@ -66,6 +82,12 @@ async def update_presence():
     bot.curstat %= len(curstat)
 
 
+@bot.event
+async def on_message(message: discord.Message):
+    # replaces the default, which only processes commands, those are a consumer now
+    await pipeline.messages.dispatch(message)
+
+
 @bot.event
 async def on_command_error(ctx, error):
     traceback.print_exception(type(error), error, error.__traceback__)
@@ -141,6 +163,12 @@ else:
         initial_extensions.remove("__pycach")  # remove __pycache__
 
 
+async def warm_up_cogs():
+    """Reads every guild's stored data once and hands it to each cog with a ``load_snapshots`` method."""
+    guilds = await conf.load_cog_snapshots(bot)
+    Log["bootstrap"].info(f"Warmed up cogs with data of {guilds} guilds")
+
+
 async def load_extensions():
     for extension in initial_extensions:
         try:
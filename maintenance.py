@@ -0,0 +1,259 @@
+import asyncio
+import contextlib
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import backups
+import db_new
+import dbstats
+from logs import Log
+
+load_dotenv()
+# Minutes between maintenance attempts
+MAINTENANCE_INTERVAL = float(os.getenv("DB_MAINTENANCE_INTERVAL", "60"))
+# Maintenance only starts while the bot runs fewer statements per second than this
+MAINTENANCE_MAX_RATE = float(os.getenv("DB_MAINTENANCE_MAX_RATE", "20"))
+# Milliseconds a single step may hold the write lock, and seconds paused between steps
+MAINTENANCE_LOCK_BUDGET = float(os.getenv("DB_MAINTENANCE_LOCK_BUDGET", "50"))
+MAINTENANCE_STEP_SLEEP = float(os.getenv("DB_MAINTENANCE_STEP_SLEEP", "0.05"))
+# Rows ANALYZE samples per index, keeps it fast on big tables (0 = all rows)
+ANALYSIS_LIMIT = int(os.getenv("DB_ANALYSIS_LIMIT", "1000"))
+
+# auto_vacuum values of PRAGMA auto_vacuum
+INCREMENTAL = 2
+
+
+@dataclass(slots=True)
+class MaintenanceReport:
+    """What one maintenance run did to one database file.
+
+    Attributes:
+        database: Name of the database, e.g. ``"main"``.
+        bytes_before: Size of the file and its WAL before the run.
+        bytes_after: Size of the file and its WAL after the run.
+        pages_freed: Pages handed back to the file system by incremental vacuum.
+        tables_analyzed: Tables whose statistics were refreshed.
+        checkpointed: Whether the WAL was fully checkpointed and truncated.
+        steps: Number of times the write lock was taken.
+        longest_step_ms: Longest time the write lock was held by a single step.
+        seconds: Duration of the whole run, pauses included.
+    """
+
+    database: str
+    bytes_before: int = 0
+    bytes_after: int = 0
+    pages_freed: int = 0
+    tables_analyzed: list[str] = field(default_factory=list)
+    checkpointed: bool = False
+    steps: int = 0
+    longest_step_ms: float = 0.0
+    seconds: float = 0.0
+
+    @property
+    def reclaimed(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+
+def _file_size(path: Path) -> int:
+    size = 0
+    for file in (path, path.with_name(path.name + "-wal")):
+        with contextlib.suppress(FileNotFoundError):
+            size += file.stat().st_size
+    return size
+
+
+def statement_count() -> int:
+    """Returns the number of statements the bot has run since the stats were last reset."""
+    return sum(histogram.count for histogram in dbstats.stats.statements.values())
+
+
+async def is_quiet(window: float = 60, max_rate: float = MAINTENANCE_MAX_RATE) -> bool:
+    """|coro|
+    Watches the database for ``window`` seconds and returns whether it ran fewer than ``max_rate`` statements per second.
+    """
+    before = statement_count()
+    await asyncio.sleep(window)
+    # a stats reset in between makes the difference negative, which counts as quiet
+    return (statement_count() - before) / window < max_rate
+
+
+class _Maintainer:
+    # One direct connection per run, used from worker threads one step at a time.
+    # Every step holds the app's writer connection, so queued writes wait for
+    # the step instead of failing on SQLite's lock, and run between steps.
+
+    def __init__(self, database: db_new.Database, budget: float, sleep: float):
+        self.database = database
+        self.budget = budget / 1000
+        self.sleep = sleep
+        self.path = backups.database_path(database)
+        self.report = MaintenanceReport(database.name)
+        # isolation_level=None, transactions are spelled out in every step
+        self.conn = sqlite3.connect(
+            self.path,
+            timeout=self.budget,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        # an automatic checkpoint at COMMIT would copy the whole WAL with the
+        # lock held, checkpoints are run between the steps instead
+        self.conn.execute("PRAGMA wal_autocheckpoint = 0")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    async def step(self, sql: str) -> float:
+        """Runs ``sql`` holding the write lock, returns how long that took in seconds."""
+        async with self.database.write_engine.connect():
+            elapsed = await asyncio.to_thread(self._run, sql)
+        self.report.steps += 1
+        self.report.longest_step_ms = max(self.report.longest_step_ms, elapsed * 1000)
+        await asyncio.sleep(self.sleep)
+        return elapsed
+
+    def _run(self, sql: str) -> float:
+        start = time.perf_counter()
+        # executescript steps every statement to completion, unlike execute,
+        # which would only free one page of an incremental_vacuum
+        self.conn.executescript(sql)
+        return time.perf_counter() - start
+
+    def pragma(self, name: str) -> int:
+        return self.conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+    async def vacuum(self) -> None:
+        if self.pragma("auto_vacuum") != INCREMENTAL:
+            free = self.pragma("freelist_count")
+            if free:
+                Log["database"].warning(
+                    f"{self.database.name} has {free} free pages but no incremental "
+                    "auto vacuum, run the vacuum command once to enable it"
+                )
+            return
+        # start small, then size the steps by how fast pages went so far
+        pages = 64
+        while (free := self.pragma("freelist_count")) > 0:
+            pages = min(pages, free)
+            elapsed = await self.step(
+                f"BEGIN IMMEDIATE; PRAGMA incremental_vacuum({pages}); COMMIT;"
+            )
+            self.report.pages_freed += free - self.pragma("freelist_count")
+            await asyncio.to_thread(self._checkpoint, "PASSIVE")
+            rate = pages / max(elapsed, 1e-6)
+            # the WAL restarts after every checkpoint, so it never grows past
+            # one step, and no bigger than autocheckpoint would let it
+            pages = max(1, min(pages * 4, int(rate * self.budget * 0.8), 1000))
+
+    async def analyze(self) -> None:
+        tables = [
+            name
+            for (name,) in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+                " AND name NOT LIKE 'sqlite_%'"
+            )
+        ]
+        # one table per step, analysis_limit keeps each of them short
+        for table in tables:
+            await self.step(f'BEGIN IMMEDIATE; ANALYZE "{table}"; COMMIT;')
+            self.report.tables_analyzed.append(table)
+        await self.step("PRAGMA optimize;")
+
+    def _checkpoint(self, mode: str) -> tuple[int, int, int]:
+        return self.conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    async def checkpoint(self) -> None:
+        # A PASSIVE checkpoint doesn't need the write lock, it does the copying.
+        # TRUNCATE then only has to reset the WAL. It waits for readers of old
+        # snapshots, but only up to the connection's timeout, i.e. one budget;
+        # if they're still there it's left for the next run.
+        await asyncio.to_thread(self._checkpoint, "PASSIVE")
+        async with self.database.write_engine.connect():
+            start = time.perf_counter()
+            busy, _, _ = await asyncio.to_thread(self._checkpoint, "TRUNCATE")
+            elapsed = time.perf_counter() - start
+        self.report.steps += 1
+        self.report.longest_step_ms = max(self.report.longest_step_ms, elapsed * 1000)
+        self.report.checkpointed = not busy
+
+
+async def maintain(
+    database: db_new.Database,
+    budget: float = MAINTENANCE_LOCK_BUDGET,
+    sleep: float = MAINTENANCE_STEP_SLEEP,
+) -> MaintenanceReport:
+    """|coro|
+    Reclaims free pages, refreshes the query planner's statistics and checkpoints the WAL of one database.
+
+    The work is split into steps that each hold the write lock for about
+    ``budget`` milliseconds, with ``sleep`` seconds in between for the bot's
+    own writes. A single ANALYZE can't be split, :data:`ANALYSIS_LIMIT` bounds it instead,
+    and resetting the WAL costs one truncate of a file of up to ~4 MB.
+
+    Returns:
+        MaintenanceReport: What was done, and how much space it reclaimed.
+    """
+    start = time.perf_counter()
+    maintainer = await asyncio.to_thread(_Maintainer, database, budget, sleep)
+    report = maintainer.report
+    report.bytes_before = await asyncio.to_thread(_file_size, maintainer.path)
+    try:
+        await maintainer.vacuum()
+        await maintainer.analyze()
+        await maintainer.checkpoint()
+    finally:
+        await asyncio.to_thread(maintainer.close)
+    report.bytes_after = await asyncio.to_thread(_file_size, maintainer.path)
+    report.seconds = time.perf_counter() - start
+    Log["database"].info(
+        f"Maintained {database.name}: reclaimed {report.reclaimed / 1024:.0f} KiB"
+        f" ({report.pages_freed} pages), analyzed {len(report.tables_analyzed)} tables,"
+        f" {report.steps} steps of at most {report.longest_step_ms:.1f} ms"
+        f" in {report.seconds:.2f}s"
+    )
+    return report
+
+
+async def maintain_all(
+    budget: float = MAINTENANCE_LOCK_BUDGET, sleep: float = MAINTENANCE_STEP_SLEEP
+) -> list[MaintenanceReport]:
+    """|coro|
+    Runs :func:`maintain` on the main database and every shard, one after another.
+    """
+    return [
+        await maintain(database, budget, sleep) for database in db_new.all_databases()
+    ]
+
+
+def _vacuum(path: Path) -> None:
+    with contextlib.closing(sqlite3.connect(path, isolation_level=None)) as conn:
+        conn.execute(f"PRAGMA auto_vacuum = {INCREMENTAL}")
+        conn.execute("VACUUM")
+
+
+async def vacuum(database: db_new.Database) -> MaintenanceReport:
+    """|coro|
+    Rebuilds the whole file with a full VACUUM, which also turns on incremental auto vacuum for files created before it.
+
+    Unlike :func:`maintain` this holds the write lock until it's done, which can
+    take seconds on a big database. Run it once, when nobody is around.
+    """
+    path = backups.database_path(database)
+    report = MaintenanceReport(database.name, steps=1)
+    report.bytes_before = await asyncio.to_thread(_file_size, path)
+    start = time.perf_counter()
+    async with database.write_engine.connect():
+        await asyncio.to_thread(_vacuum, path)
+    report.seconds = time.perf_counter() - start
+    report.longest_step_ms = report.seconds * 1000
+    report.bytes_after = await asyncio.to_thread(_file_size, path)
+    Log["database"].warning(
+        f"Vacuumed {database.name}: reclaimed {report.reclaimed / 1024:.0f} KiB"
+        f" in {report.seconds:.2f}s"
+    )
+    return report
@@ -0,0 +1,163 @@
+import asyncio
+import re
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import discord
+
+import conf
+import triggers
+from dbstats import LatencyHistogram
+from logs import Log
+
+_WORD = re.compile(r"\w+")
+# mentions and custom emojis, their IDs aren't words
+_MARKUP = re.compile(r"<(?:@[!&]?|#|a?:\w+:)\d+>")
+_CUSTOM_EMOJI = re.compile(r"<a?:\w+:(\d+)>")
+# the blocks most emoji live in, close enough for prefilters
+_UNICODE_EMOJI = re.compile("[\u2600-\u27bf\U0001f000-\U0001faff]\ufe0f?")
+
+
+@dataclass(frozen=True, slots=True)
+class MessageFeatures:
+    """What's computed about a message once, for every consumer to share.
+
+    Attributes:
+        message: The message itself.
+        normalized: Its content passed through :func:`triggers.normalize`.
+        tokens: The words of the normalized content, without mentions and custom emojis.
+        user_mentions: IDs of the users mentioned in it.
+        role_mentions: IDs of the roles mentioned in it.
+        channel_mentions: IDs of the channels mentioned in it.
+        custom_emojis: IDs of the custom emojis used in it.
+        unicode_emojis: The unicode emojis used in it, in order.
+        settings: The guild's config, ``None`` for DMs.
+    """
+
+    message: discord.Message
+    normalized: str
+    tokens: frozenset[str]
+    user_mentions: tuple[int, ...]
+    role_mentions: tuple[int, ...]
+    channel_mentions: tuple[int, ...]
+    custom_emojis: tuple[int, ...]
+    unicode_emojis: tuple[str, ...]
+    settings: conf.ServerSettings | None
+
+    @property
+    def guild_id(self) -> int | None:
+        return self.settings.guild_id if self.settings else None
+
+
+async def extract(message: discord.Message) -> MessageFeatures:
+    """|coro|
+    Computes the features of a message. Only the guild config can take a
+    lookup, and it comes from the shared cache nearly every time.
+    """
+    content = message.content
+    normalized = triggers.normalize(content)
+    return MessageFeatures(
+        message=message,
+        normalized=normalized,
+        tokens=frozenset(_WORD.findall(_MARKUP.sub(" ", normalized))),
+        user_mentions=tuple(message.raw_mentions),
+        role_mentions=tuple(message.raw_role_mentions),
+        channel_mentions=tuple(message.raw_channel_mentions),
+        custom_emojis=tuple(int(i) for i in _CUSTOM_EMOJI.findall(content)),
+        unicode_emojis=tuple(_UNICODE_EMOJI.findall(content)),
+        settings=(
+            await conf.get_server_config(message.guild.id) if message.guild else None
+        ),
+    )
+
+
+@dataclass(slots=True)
+class Consumer:
+    """A feature looking at messages.
+
+    Attributes:
+        name: Shown in the stats.
+        handler: Called with the features of every message passing ``prefilter``.
+        prefilter: Decides from the features alone whether the message is of interest, must be cheap.
+        timings: How long ``handler`` took per message.
+        skipped: Messages ``prefilter`` turned down.
+    """
+
+    name: str
+    handler: Callable[[MessageFeatures], Awaitable[None]]
+    prefilter: Callable[[MessageFeatures], bool]
+    timings: LatencyHistogram = field(default_factory=LatencyHistogram)
+    skipped: int = 0
+
+
+def _always(features: MessageFeatures) -> bool:
+    return True
+
+
+class MessagePipeline:
+    """Computes the features of every message once and hands them to the consumers interested in it.
+
+    Consumers matching the same message run concurrently, like separate
+    ``on_message`` listeners would.
+
+    Attributes:
+        consumers: Registered consumers, by name.
+        extraction: How long computing the features took per message.
+        since: When the stats were last reset.
+    """
+
+    def __init__(self):
+        self.consumers: dict[str, Consumer] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.extraction = LatencyHistogram()
+        for consumer in self.consumers.values():
+            consumer.timings = LatencyHistogram()
+            consumer.skipped = 0
+        self.since = time.time()
+
+    def register(
+        self,
+        name: str,
+        handler: Callable[[MessageFeatures], Awaitable[None]],
+        prefilter: Callable[[MessageFeatures], bool] = _always,
+    ) -> None:
+        """Adds a consumer, replacing the one with the same name, e.g. when a cog is reloaded."""
+        self.consumers[name] = Consumer(name, handler, prefilter)
+
+    def unregister(self, name: str) -> None:
+        self.consumers.pop(name, None)
+
+    async def dispatch(self, message: discord.Message) -> None:
+        start = time.perf_counter()
+        features = await extract(message)
+        self.extraction.observe(time.perf_counter() - start)
+        matched = []
+        for consumer in list(self.consumers.values()):
+            if consumer.prefilter(features):
+                matched.append(consumer)
+            else:
+                consumer.skipped += 1
+        if len(matched) == 1:
+            await self._run(matched[0], features)
+        elif matched:
+            await asyncio.gather(*(self._run(c, features) for c in matched))
+
+    async def _run(self, consumer: Consumer, features: MessageFeatures) -> None:
+        start = time.perf_counter()
+        try:
+            await consumer.handler(features)
+        except Exception as e:
+            # one failing consumer mustn't keep the others from the message
+            Log["messages"].error(
+                f"{consumer.name} failed on message {features.message.id}: {e}"
+            )
+            traceback.print_exc()
+        finally:
+            consumer.timings.observe(time.perf_counter() - start)
+
+
+messages = MessagePipeline()
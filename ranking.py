@@ -0,0 +1,154 @@
+import random
+from typing import Any, Iterable
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Any, level: int):
+        self.key = key
+        self.next: list["_Node"] = [None] * level
+        # number of positions skipped by following next[level]
+        self.width: list[int] = [1] * level
+
+
+class SkipList:
+    """Sorted multiset of keys with O(log n) expected insert, remove and rank.
+
+    Every link remembers how many entries it skips, so counting the keys
+    before a given key (:meth:`bisect_left`) is a single descent.
+    """
+
+    MAX_LEVEL = 32
+
+    def __init__(self, keys: Iterable = ()):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._nil = _Node(None, self.MAX_LEVEL)
+        self._size = 0
+        self.load(keys)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not self._nil:
+            yield node.key
+            node = node.next[0]
+
+    @classmethod
+    def _random_level(cls) -> int:
+        level = 1
+        while level < cls.MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def load(self, keys: Iterable) -> None:
+        """Replaces the contents with ``keys``, linking them in one pass after sorting."""
+        last = [self._head] * self.MAX_LEVEL
+        last_position = [0] * self.MAX_LEVEL
+        position = 0
+        for position, key in enumerate(sorted(keys), start=1):
+            node = _Node(key, self._random_level())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+        for level in range(self.MAX_LEVEL):
+            last[level].next[level] = self._nil
+            last[level].width[level] = position + 1 - last_position[level]
+        self._size = position
+
+    def _find(self, key) -> tuple[list[_Node], list[int]]:
+        # the last node before ``key`` on every level, and its position
+        chain = [None] * self.MAX_LEVEL
+        positions = [0] * self.MAX_LEVEL
+        node = self._head
+        position = 0
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not self._nil and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, key) -> None:
+        chain, positions = self._find(key)
+        node = _Node(key, self._random_level())
+        position = positions[0] + 1
+        for level in range(len(node.next)):
+            previous = chain[level]
+            node.next[level] = previous.next[level]
+            previous.next[level] = node
+            skipped = position - positions[level]
+            node.width[level] = previous.width[level] - skipped + 1
+            previous.width[level] = skipped
+        for level in range(len(node.next), self.MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key) -> None:
+        """Removes one occurrence of ``key``, raising KeyError if there is none."""
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        if node is self._nil or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self.MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def bisect_left(self, key) -> int:
+        """Returns the number of keys smaller than ``key``."""
+        _, positions = self._find(key)
+        return positions[0]
+
+
+class StarbitsRanking:
+    """Every user's starbits balance, ordered richest first.
+
+    Kept in sync by the starbits setters in :mod:`conf`, so looking up a
+    user's position doesn't need to touch the database.
+    """
+
+    def __init__(self):
+        self._balances: dict[int, int] = {}
+        # (-balance, user_id), so the richest user sorts first
+        self._ranks = SkipList()
+
+    def __len__(self) -> int:
+        return len(self._balances)
+
+    def load(self, balances: Iterable[tuple[int, int]]) -> None:
+        """Replaces every balance with the given ``(user_id, balance)`` pairs."""
+        self._balances = dict(balances)
+        self._ranks.load(
+            (-balance, user_id) for user_id, balance in self._balances.items()
+        )
+
+    def update(self, user_id: int, balance: int) -> None:
+        old = self._balances.get(user_id)
+        if old == balance:
+            return
+        if old is not None:
+            self._ranks.remove((-old, user_id))
+        self._ranks.insert((-balance, user_id))
+        self._balances[user_id] = balance
+
+    def rank(self, user_id: int) -> int | None:
+        """Returns the user's position, 1 being the richest, or ``None`` if they have no balance yet.
+
+        Users with equal balances share a position.
+        """
+        balance = self._balances.get(user_id)
+        if balance is None:
+            return None
+        return self._ranks.bisect_left((-balance,)) + 1
+
+
+starbits = StarbitsRanking()
@@ -0,0 +1,28 @@
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Point the bot at throwaway files before any of its modules is imported,
+# db_new reads the environment and logs opens latest.log in the working directory.
+_TMP = tempfile.mkdtemp(prefix="tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_TMP}/database.db"
+os.environ["DB_BACKUP_DIR"] = os.path.join(_TMP, "backups")
+os.chdir(_TMP)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="session")
+def run():
+    """Runs coroutines on one loop, the engines and the writer task are bound to it."""
+    import db_new
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(db_new.init_db())
+    yield loop.run_until_complete
+    for db in db_new.all_databases():
+        loop.run_until_complete(db.writer.close())
+    loop.close()
@@ -0,0 +1,35 @@
+import asyncio
+import threading
+import time
+
+import backups
+import conf
+import db_new
+
+
+def test_write_queued_during_a_slow_restore(run, monkeypatch):
+    run(conf.add_starbits(5001, 10))
+    name = run(backups.create_backup()).name
+    run(conf.add_starbits(5001, 90))
+
+    copying = threading.Event()
+    restore_snapshot = backups._restore_snapshot
+
+    def slow_restore_snapshot(snapshot, target):
+        copying.set()
+        time.sleep(0.5)
+        restore_snapshot(snapshot, target)
+
+    monkeypatch.setattr(backups, "_restore_snapshot", slow_restore_snapshot)
+    # shorter than the restore, so a writer waiting on the pool would give up
+    monkeypatch.setattr(db_new.database.write_engine.pool, "_timeout", 0.1)
+
+    async def restore_while_writing():
+        restore = asyncio.create_task(backups.restore_backup(name))
+        await asyncio.to_thread(copying.wait)
+        balance = await conf.add_starbits(5001, 5)
+        await restore
+        return balance
+
+    # committed after the restore, on top of the restored balance
+    assert run(restore_while_writing()) == 15
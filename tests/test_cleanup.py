@@ -0,0 +1,72 @@
+import cleanup
+import db_new
+
+
+class _Index:
+    def __init__(self, message_ids):
+        self.roles = {message_id: {"👍": 1} for message_id in message_ids}
+
+
+class _Cog:
+    def __init__(self, message_ids):
+        self.index = _Index(message_ids)
+        self.forgotten = []
+
+    def forget_messages(self, guild_id, message_ids):
+        self.forgotten.append(message_ids)
+
+
+class _Bot:
+    def __init__(self, cogs):
+        self.cogs = cogs
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+
+async def _write(guild_id, job, *args):
+    return await db_new.write_guild(guild_id, job, *args)
+
+
+def _reaction_role(run, guild_id, message_id, role_id):
+    run(
+        _write(
+            guild_id,
+            db_new.create_reaction_role,
+            guild_id,
+            guild_id + 1,
+            message_id,
+            role_id,
+            "👍",
+        )
+    )
+
+
+def test_referenced_roles(run):
+    run(_write(2000, db_new.create_auto_role, 2000, 2010))
+    _reaction_role(run, 2000, 2020, 2011)
+
+    async def referenced():
+        async with db_new.get_session(2000) as session:
+            return await db_new.get_referenced_roles(session, {2010, 2011, 2012})
+
+    assert run(referenced()) == {2010, 2011}
+
+
+def test_purge_messages_skips_misses_of_the_index(run):
+    _reaction_role(run, 3000, 3020, 3010)
+    cog = _Cog({3020})
+    bot = _Bot({"ReactionRoles": cog})
+
+    assert run(cleanup.purge_messages(bot, 3000, {3021})) == 0
+    assert cog.forgotten == []
+    assert run(cleanup.purge_messages(bot, 3000, {3020, 3021})) == 1
+    assert cog.forgotten == [{3020}]
+
+
+def test_purge_messages_without_the_index(run):
+    _reaction_role(run, 4000, 4020, 4010)
+    bot = _Bot({})
+
+    assert run(cleanup.purge_messages(bot, 4000, {4021})) == 0
+    assert run(cleanup.purge_messages(bot, 4000, {4020})) == 1
@@ -0,0 +1,22 @@
+import conf
+
+
+def test_gamble_nothing_without_a_balance(run):
+    assert run(conf.gamble_starbits(1001, 0, 0)) == 0
+    assert run(conf.gamble_starbits(1001, 0, 0)) == 0
+
+
+def test_gamble_more_than_the_default_balance(run):
+    assert run(conf.gamble_starbits(1002, 1, 3)) is None
+
+
+def test_gamble_settles_stake_and_payout(run):
+    run(conf.add_starbits(1003, 100))
+    assert run(conf.gamble_starbits(1003, 40, 120)) == 180
+    assert run(conf.gamble_starbits(1003, 200, 600)) is None
+    assert run(conf.gamble_starbits(1003, 0, 0)) == 180
+
+
+def test_gamble_nothing_with_a_negative_balance(run):
+    run(conf.add_starbits(1004, -5))
+    assert run(conf.gamble_starbits(1004, 0, 0)) is None
@@ -0,0 +1,233 @@
+"""Streams all bot data to or from gzipped NDJSON, and seeds fake data for load tests.
+
+Run from the repository root:
+
+    python -m tools.data export backup.ndjson.gz
+    python -m tools.data import backup.ndjson.gz
+    python -m tools.data seed --users 2000000 --guilds 50000
+
+Every line is one row: ``{"table": "userconfig", "row": {...}}``. Exports read
+each table through a streaming cursor, so memory use stays flat however big
+the database is. Imports and seeds insert in large batches, one transaction
+per batch, routing guild-scoped rows to their shard if sharding is on.
+
+Import into an empty database. Rows whose key already exists are skipped,
+and reaction roles, auto roles and trigger rules get new IDs, because their
+IDs come from each shard's own counter and can clash.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator
+
+from sqlalchemy import DateTime, Table
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import SQLModel
+
+import db_new
+from logs import Log
+
+# Rows per transaction when importing
+BATCH_SIZE = 50_000
+# Rows fetched from the cursor at once when exporting
+FETCH_SIZE = 5_000
+# Surrogate keys that are left to the target database to assign
+RENUMBERED = {
+    "reactionrole": "ReactRoleID",
+    "autorole": "AutoRoleID",
+    "triggerrule": "TriggerID",
+}
+
+TABLES: dict[str, Table] = {
+    table.name: table for table in SQLModel.metadata.sorted_tables
+}
+GUILD_COLUMNS = {
+    model.__tablename__: column for model, column in db_new.GUILD_TABLES.items()
+}
+
+
+def _databases_for(table: Table) -> list[db_new.Database]:
+    if table.name in GUILD_COLUMNS:
+        return db_new.guild_databases()
+    return [db_new.database]
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def export(path: str) -> dict[str, int]:
+    """|coro|
+    Writes every row of every table to ``path``.
+
+    Returns:
+        dict[str, int]: Number of rows written per table.
+    """
+    counts = {}
+    with gzip.open(path, "wt", encoding="utf-8") as out:
+        for name, table in TABLES.items():
+            counts[name] = 0
+            for database in _databases_for(table):
+                async with database.session() as session:
+                    async for row in db_new.stream_columns(
+                        session, *table.columns, batch_size=FETCH_SIZE
+                    ):
+                        record = {
+                            key: _encode(value) for key, value in row._mapping.items()
+                        }
+                        out.write(json.dumps({"table": name, "row": record}) + "\n")
+                        counts[name] += 1
+            Log["database"].info(f"Exported {counts[name]} {name} rows")
+    return counts
+
+
+def read_records(path: str) -> Iterator[tuple[str, dict]]:
+    """Yields ``(table, row)`` pairs from an export, one line at a time."""
+    with gzip.open(path, "rt", encoding="utf-8") as lines:
+        for line in lines:
+            record = json.loads(line)
+            yield record["table"], record["row"]
+
+
+def _is_datetime(column) -> bool:
+    # sqlmodel wraps DateTime in a TypeDecorator, check what it decorates
+    return isinstance(getattr(column.type, "impl", column.type), DateTime)
+
+
+def _decoder(table: Table):
+    datetimes = [column.name for column in table.columns if _is_datetime(column)]
+    renumbered = RENUMBERED.get(table.name)
+
+    def decode(row: dict) -> dict:
+        for name in datetimes:
+            if isinstance(row.get(name), str):
+                row[name] = datetime.fromisoformat(row[name])
+        if renumbered:
+            row.pop(renumbered, None)
+        return row
+
+    return decode
+
+
+async def _insert_batch(
+    database: db_new.Database, table: Table, rows: list[dict]
+) -> None:
+    # one executemany of one compiled statement, much cheaper than ORM objects
+    async with database.write_engine.begin() as conn:
+        await conn.execute(insert(table).on_conflict_do_nothing(), rows)
+
+
+async def import_records(
+    records: Iterable[tuple[str, dict]], batch_size: int = BATCH_SIZE
+) -> dict[str, int]:
+    """|coro|
+    Inserts ``(table, row)`` pairs, ``batch_size`` rows per transaction and database.
+
+    Returns:
+        dict[str, int]: Number of rows read per table.
+    """
+    decoders = {name: _decoder(table) for name, table in TABLES.items()}
+    batches: dict[tuple[db_new.Database, str], list[dict]] = {}
+    counts: dict[str, int] = {}
+    for name, row in records:
+        row = decoders[name](row)
+        guild_column = GUILD_COLUMNS.get(name)
+        database = db_new.database_for(row[guild_column] if guild_column else None)
+        batch = batches.setdefault((database, name), [])
+        batch.append(row)
+        counts[name] = counts.get(name, 0) + 1
+        if len(batch) >= batch_size:
+            await _insert_batch(database, TABLES[name], batch)
+            batches[database, name] = []
+    for (database, name), batch in batches.items():
+        if batch:
+            await _insert_batch(database, TABLES[name], batch)
+    for name, count in counts.items():
+        Log["database"].info(f"Imported {count} {name} rows")
+    return counts
+
+
+def seed_records(users: int, guilds: int, seed: int = 0) -> Iterator[tuple[str, dict]]:
+    """Yields a made-up dataset shaped like a real one, for load tests.
+
+    Every guild gets a config, two auto roles, five reaction roles and a temp
+    channel. IDs look like Discord snowflakes so they hash like real ones.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    base = 1 << 60
+
+    for user in range(users):
+        yield "userconfig", {
+            "UserID": base + user,
+            "TempVoiceChannelName": None if rng.random() < 0.9 else f"user {user}",
+            "Starbits": int(rng.paretovariate(1.2) * 10) if rng.random() < 0.6 else 0,
+            "StarbitsNext": now + timedelta(seconds=rng.randint(-86400, 86400)),
+        }
+    for guild in range(guilds):
+        guild_id = base + users + guild * 100
+        yield "serverconfig", {
+            "ServerID": guild_id,
+            "WelcomeChannelID": guild_id + 1 if rng.random() < 0.5 else None,
+            "VoiceCreationChannelID": guild_id + 2 if rng.random() < 0.3 else None,
+            "ReactionToggle": rng.random() < 0.8,
+        }
+        for role in range(2):
+            yield "autorole", {"GuildID": guild_id, "RoleID": guild_id + 10 + role}
+        for reaction in range(5):
+            yield "reactionrole", {
+                "GuildID": guild_id,
+                "MessageID": guild_id + 20 + reaction // 2,
+                "ChannelID": guild_id + 3,
+                "RoleID": guild_id + 30 + reaction,
+                "Emoji": chr(0x1F600 + reaction),
+            }
+        yield "tempchannel", {"ChannelID": guild_id + 40, "GuildID": guild_id}
+
+
+async def main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog="python -m tools.data", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write all data to a file")
+    export_parser.add_argument("path")
+    import_parser = commands.add_parser("import", help="insert all data from a file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    seed_parser = commands.add_parser("seed", help="insert a made-up dataset")
+    seed_parser.add_argument("--users", type=int, default=100_000)
+    seed_parser.add_argument("--guilds", type=int, default=1_000)
+    seed_parser.add_argument("--seed", type=int, default=0)
+    seed_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    await db_new.init_db()
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            counts = await export(args.path)
+        elif args.command == "import":
+            counts = await import_records(read_records(args.path), args.batch_size)
+        else:
+            counts = await import_records(
+                seed_records(args.users, args.guilds, args.seed), args.batch_size
+            )
+    finally:
+        for database in db_new.all_databases():
+            await database.dispose()
+    elapsed = time.perf_counter() - start
+    rows = sum(counts.values())
+    print(
+        f"{args.command}: {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,78 @@
+"""Moves the guild-scoped tables of the main database into its shards.
+
+Run from the repository root, with the bot stopped and ``DB_SHARDS`` set:
+
+    python -m tools.split_shards
+
+Every ServerConfig, AutoRole, ReactionRole, TempChannel and TriggerRule row is
+copied to the shard its guild hashes to, then deleted from the main database.
+Rows that are already in their shard are skipped, so an interrupted run can
+simply be started again. Take a backup first.
+"""
+
+import asyncio
+
+from sqlalchemy import delete
+
+import db_new
+from logs import Log
+
+BATCH_SIZE = 1000
+
+
+async def _copy(model, guild_column: str, rows: list[dict]) -> None:
+    by_database: dict[db_new.Database, list[dict]] = {}
+    for row in rows:
+        by_database.setdefault(db_new.database_for(row[guild_column]), []).append(row)
+    for database, shard_rows in by_database.items():
+        async with database.session() as session:
+            await db_new._insert_many(session, model, shard_rows, skip_existing=True)
+            await session.commit()
+
+
+async def split() -> dict[str, int]:
+    """|coro|
+    Moves every guild-scoped row from the main database to its shard.
+
+    Returns:
+        dict[str, int]: Number of rows moved per table.
+    """
+    if not db_new.shards:
+        raise SystemExit("DB_SHARDS is not set, there are no shards to split into")
+    await db_new.init_db()
+    moved = {}
+    for model, guild_column in db_new.GUILD_TABLES.items():
+        rows = []
+        moved[model.__tablename__] = 0
+        async with db_new.database.session() as session:
+            async for row in db_new.stream_columns(
+                session, *model.__table__.columns, batch_size=BATCH_SIZE
+            ):
+                rows.append(dict(row._mapping))
+                if len(rows) == BATCH_SIZE:
+                    await _copy(model, guild_column, rows)
+                    moved[model.__tablename__] += len(rows)
+                    rows = []
+        await _copy(model, guild_column, rows)
+        moved[model.__tablename__] += len(rows)
+        # only once every row is safely in its shard
+        async with db_new.database.session() as session:
+            await session.exec(delete(model))
+            await session.commit()
+        Log["database"].info(
+            f"Moved {moved[model.__tablename__]} {model.__tablename__} rows "
+            f"into {len(db_new.shards)} shards"
+        )
+    return moved
+
+
+async def main():
+    try:
+        await split()
+    finally:
+        for database in db_new.all_databases():
+            await database.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
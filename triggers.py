@@ -0,0 +1,129 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterable
+
+CONTAINS = "contains"
+EXACT = "exact"
+MATCHES = (CONTAINS, EXACT)
+
+# react to the message
+REACT = "react"
+# react to the message it replies to, then delete it
+REACT_TO_REPLY = "react_to_reply"
+
+
+@dataclass(frozen=True, slots=True)
+class Trigger:
+    """A reaction to messages containing or being some text.
+
+    Attributes:
+        pattern: Text to look for, compared after :func:`normalize`.
+        match: :data:`CONTAINS` or :data:`EXACT`.
+        reaction: Emoji to react with, unicode or ``<:name:id>``.
+        action: :data:`REACT` or :data:`REACT_TO_REPLY`.
+        trigger_id: ID of the stored rule, ``None`` for built-in ones.
+    """
+
+    pattern: str
+    match: str
+    reaction: str
+    action: str = REACT
+    trigger_id: int | None = None
+
+
+# Reactions every guild gets while reactions are toggled on
+DEFAULT_TRIGGERS = (
+    Trigger("fr", CONTAINS, "🇫🇷"),
+    Trigger("ts pmo", EXACT, "💔"),
+    Trigger("🗿", CONTAINS, "🗿"),
+    Trigger("ok", EXACT, "👍"),
+    Trigger("good boy", EXACT, "😊"),
+    Trigger("this", EXACT, "<:this:1346958257033445387>", REACT_TO_REPLY),
+)
+
+
+def normalize(content: str) -> str:
+    """Case-folds the text and collapses whitespace, the form patterns are compared in."""
+    return " ".join(content.casefold().split())
+
+
+class AhoCorasick:
+    """Finds which of many patterns occur in a text, in one pass over it.
+
+    The trie's failure links are flattened into a full transition table when
+    it's built, so matching costs one dict lookup per character however many
+    patterns there are.
+    """
+
+    __slots__ = ("_delta", "_outputs")
+
+    def __init__(self, patterns: Iterable[str]):
+        goto: list[dict[str, int]] = [{}]
+        outputs: list[tuple[int, ...]] = [()]
+        for index, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                if char not in goto[state]:
+                    goto[state][char] = len(goto)
+                    goto.append({})
+                    outputs.append(())
+                state = goto[state][char]
+            outputs[state] += (index,)
+
+        # breadth first, so a state's failure state is complete before it's used
+        delta: list[dict[str, int]] = [{}] * len(goto)
+        delta[0] = dict(goto[0])
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            delta[state] = {**delta[fail[state]], **goto[state]}
+            outputs[state] += outputs[fail[state]]
+            for char, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(char, 0) if state else 0
+                queue.append(child)
+        self._delta = delta
+        self._outputs = outputs
+
+    def search(self, text: str) -> set[int]:
+        """Returns the indexes of the patterns occurring in ``text``."""
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        found = set()
+        for char in text:
+            state = delta[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+
+class TriggerSet:
+    """Triggers compiled for matching, an automaton for the contains ones and a dict for the exact ones."""
+
+    __slots__ = ("triggers", "_contains", "_automaton", "_exact")
+
+    def __init__(self, triggers: Iterable[Trigger]):
+        self.triggers = tuple(triggers)
+        # positions in self.triggers, so matches come out in the order the triggers were given
+        self._contains: list[int] = []
+        self._exact: dict[str, list[int]] = {}
+        for position, trigger in enumerate(self.triggers):
+            if trigger.match == EXACT:
+                self._exact.setdefault(normalize(trigger.pattern), []).append(position)
+            else:
+                self._contains.append(position)
+        self._automaton = AhoCorasick(
+            normalize(self.triggers[position].pattern) for position in self._contains
+        )
+
+    def match(self, normalized: str) -> list[Trigger]:
+        """Returns the triggers matching a message, whose content was passed through :func:`normalize`."""
+        positions = [self._contains[i] for i in self._automaton.search(normalized)]
+        positions += self._exact.get(normalized, ())
+        return [self.triggers[position] for position in sorted(positions)]
+
+
+DEFAULT_SET = TriggerSet(DEFAULT_TRIGGERS)